@@ -0,0 +1,32 @@
+"""product keyset indexes
+
+Revision ID: a1c4e2f7b913
+Revises: 6b33d377c7c4
+Create Date: 2026-10-17 23:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a1c4e2f7b913'
+down_revision: Union[str, None] = '6b33d377c7c4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_products_price_id', 'products', ['price', 'id'], unique=False)
+    op.create_index('ix_products_created_at_id', 'products', ['created_at', 'id'], unique=False)
+    op.create_index('ix_products_title_id', 'products', ['title', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_products_title_id', table_name='products')
+    op.drop_index('ix_products_created_at_id', table_name='products')
+    op.drop_index('ix_products_price_id', table_name='products')
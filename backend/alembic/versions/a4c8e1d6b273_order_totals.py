@@ -0,0 +1,51 @@
+"""order totals
+
+Revision ID: a4c8e1d6b273
+Revises: f2b7d4a9c360
+Create Date: 2026-10-18 03:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4c8e1d6b273'
+down_revision: Union[str, None] = 'f2b7d4a9c360'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('orders', sa.Column('total_amount', sa.Float(), nullable=True))
+    op.add_column('orders', sa.Column('items_count', sa.Integer(), nullable=True))
+    op.add_column('order_items', sa.Column('unit_price', sa.Float(), nullable=True))
+    # Для старых заказов цена на момент покупки не сохранилась — берём текущую
+    op.execute("""
+        UPDATE order_items SET unit_price = products.price
+        FROM products, orders
+        WHERE products.id = order_items.product_id
+          AND orders.id = order_items.order_id
+          AND orders.status = 'COMPLETED'
+    """)
+    op.execute("""
+        UPDATE orders SET total_amount = totals.total_amount, items_count = totals.items_count
+        FROM (
+            SELECT order_id, sum(quantity * unit_price) AS total_amount, sum(quantity) AS items_count
+            FROM order_items
+            GROUP BY order_id
+        ) AS totals
+        WHERE totals.order_id = orders.id AND orders.status = 'COMPLETED'
+    """)
+    op.create_index('ix_orders_user_status_created_at_id', 'orders', ['user_id', 'status', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_orders_user_status_created_at_id', table_name='orders')
+    op.drop_column('order_items', 'unit_price')
+    op.drop_column('orders', 'items_count')
+    op.drop_column('orders', 'total_amount')
@@ -0,0 +1,53 @@
+"""product rating stats
+
+Revision ID: b7d2f0c4e815
+Revises: a1c4e2f7b913
+Create Date: 2026-10-17 23:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d2f0c4e815'
+down_revision: Union[str, None] = 'a1c4e2f7b913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('product_rating_stats',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('rating_sum', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('rating_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('avg_rating', sa.Float(), server_default='0', nullable=False),
+    sa.Column('stars_1', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('stars_2', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('stars_3', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('stars_4', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('stars_5', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id')
+    )
+    op.create_index(op.f('ix_product_rating_stats_avg_rating'), 'product_rating_stats', ['avg_rating'], unique=False)
+    # Заполняем агрегаты по уже существующим оценкам
+    op.execute("""
+        INSERT INTO product_rating_stats
+            (product_id, rating_sum, rating_count, avg_rating, stars_1, stars_2, stars_3, stars_4, stars_5)
+        SELECT product_id, SUM(value), COUNT(*), AVG(value)::float,
+               COUNT(*) FILTER (WHERE value = 1), COUNT(*) FILTER (WHERE value = 2),
+               COUNT(*) FILTER (WHERE value = 3), COUNT(*) FILTER (WHERE value = 4),
+               COUNT(*) FILTER (WHERE value = 5)
+        FROM ratings
+        GROUP BY product_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_product_rating_stats_avg_rating'), table_name='product_rating_stats')
+    op.drop_table('product_rating_stats')
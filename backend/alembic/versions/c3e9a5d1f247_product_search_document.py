@@ -0,0 +1,42 @@
+"""product search document
+
+Revision ID: c3e9a5d1f247
+Revises: b7d2f0c4e815
+Create Date: 2026-10-17 23:55:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3e9a5d1f247'
+down_revision: Union[str, None] = 'b7d2f0c4e815'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.add_column('products', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+    # Заполняем поисковый документ для существующих товаров (веса как в app/search.py)
+    op.execute("""
+        UPDATE products SET search_vector =
+            setweight(to_tsvector('russian', coalesce(products.title, '')), 'A') ||
+            setweight(to_tsvector('russian', coalesce((SELECT name FROM brands WHERE brands.id = products.brand_id), '')), 'B') ||
+            setweight(to_tsvector('russian', coalesce((SELECT name FROM music_types WHERE music_types.id = products.music_type_id), '')), 'B') ||
+            setweight(to_tsvector('russian', coalesce(products.description, '')), 'C')
+    """)
+    op.create_index('ix_products_search_vector', 'products', ['search_vector'], unique=False, postgresql_using='gin')
+    op.create_index('ix_products_title_trgm', 'products', ['title'], unique=False, postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_products_title_trgm', table_name='products')
+    op.drop_index('ix_products_search_vector', table_name='products')
+    op.drop_column('products', 'search_vector')
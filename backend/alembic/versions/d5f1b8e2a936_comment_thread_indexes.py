@@ -0,0 +1,40 @@
+"""comment thread indexes
+
+Revision ID: d5f1b8e2a936
+Revises: c3e9a5d1f247
+Create Date: 2026-10-18 00:40:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5f1b8e2a936'
+down_revision: Union[str, None] = 'c3e9a5d1f247'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Сверяем сохранённый рейтинг отзыва с голосами
+    op.execute("""
+        UPDATE comments SET rating = coalesce(
+            (SELECT sum(value) FROM comment_ratings WHERE comment_ratings.comment_id = comments.id), 0
+        )
+    """)
+    op.alter_column('comments', 'rating', server_default='0')
+    op.create_index('ix_comments_product_rating_id', 'comments', ['product_id', 'rating', 'id'], unique=False, postgresql_where=sa.text('parent_id IS NULL'))
+    op.create_index('ix_comments_product_created_at_id', 'comments', ['product_id', 'created_at', 'id'], unique=False, postgresql_where=sa.text('parent_id IS NULL'))
+    op.create_index('ix_comments_parent_id', 'comments', ['parent_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_comments_parent_id', table_name='comments')
+    op.drop_index('ix_comments_product_created_at_id', table_name='comments')
+    op.drop_index('ix_comments_product_rating_id', table_name='comments')
+    op.alter_column('comments', 'rating', server_default=None)
@@ -0,0 +1,45 @@
+"""product purchases
+
+Revision ID: e8a3c6f0d152
+Revises: d5f1b8e2a936
+Create Date: 2026-10-18 01:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8a3c6f0d152'
+down_revision: Union[str, None] = 'd5f1b8e2a936'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('product_purchases',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('first_order_id', sa.Integer(), nullable=True),
+    sa.Column('purchased_at', sa.DateTime(), server_default='now()', nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['first_order_id'], ['orders.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('user_id', 'product_id')
+    )
+    # Переносим уже оплаченные покупки
+    op.execute("""
+        INSERT INTO product_purchases (user_id, product_id, first_order_id, purchased_at)
+        SELECT orders.user_id, order_items.product_id, min(orders.id), min(orders.created_at)
+        FROM order_items JOIN orders ON orders.id = order_items.order_id
+        WHERE orders.status = 'COMPLETED'
+        GROUP BY orders.user_id, order_items.product_id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('product_purchases')
@@ -0,0 +1,61 @@
+"""cart uniqueness
+
+Revision ID: f2b7d4a9c360
+Revises: e8a3c6f0d152
+Create Date: 2026-10-18 02:20:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2b7d4a9c360'
+down_revision: Union[str, None] = 'e8a3c6f0d152'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Лишние открытые корзины: позиции переносим в самую раннюю, сами корзины отменяем
+    op.execute("""
+        WITH carts AS (
+            SELECT id, min(id) OVER (PARTITION BY user_id) AS keep_id
+            FROM orders WHERE status = 'ORDERED'
+        )
+        UPDATE order_items SET order_id = carts.keep_id
+        FROM carts
+        WHERE order_items.order_id = carts.id AND carts.id <> carts.keep_id
+    """)
+    op.execute("""
+        UPDATE orders SET status = 'CANCELLED'
+        WHERE status = 'ORDERED' AND id NOT IN (
+            SELECT min(id) FROM orders WHERE status = 'ORDERED' GROUP BY user_id
+        )
+    """)
+    # Повторяющиеся позиции одного заказа складываем в одну
+    op.execute("""
+        WITH totals AS (
+            SELECT min(id) AS keep_id, order_id, product_id, sum(quantity) AS quantity
+            FROM order_items GROUP BY order_id, product_id HAVING count(*) > 1
+        )
+        UPDATE order_items SET quantity = totals.quantity
+        FROM totals WHERE order_items.id = totals.keep_id
+    """)
+    op.execute("""
+        DELETE FROM order_items USING order_items AS kept
+        WHERE order_items.order_id = kept.order_id
+          AND order_items.product_id = kept.product_id
+          AND order_items.id > kept.id
+    """)
+    op.create_unique_constraint('uq_order_items_order_product', 'order_items', ['order_id', 'product_id'])
+    op.create_index('uq_orders_user_open_cart', 'orders', ['user_id'], unique=True, postgresql_where=sa.text("status = 'ORDERED'"))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_orders_user_open_cart', table_name='orders')
+    op.drop_constraint('uq_order_items_order_product', 'order_items', type_='unique')
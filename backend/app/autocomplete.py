@@ -0,0 +1,146 @@
+import asyncio
+import bisect
+import logging
+from typing import Optional
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import async_session_maker
+from app.models import Product, Brand, MusicType, OrderItem, Order, OrderStatusEnum, ProductRatingStats
+
+logger = logging.getLogger(__name__)
+
+# Сколько подсказок хранится в каждом узле и насколько глубоко индексируются префиксы
+TOP_K = 10
+MAX_PREFIX = 16
+REBUILD_INTERVAL = 900.0
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().replace("ё", "е").split())
+
+
+class _Node:
+    __slots__ = ("children", "top", "longer")
+
+    def __init__(self):
+        self.children: dict[str, "_Node"] = {}
+        # Отсортированы по (-популярность, название); не больше TOP_K
+        self.top: list[tuple] = []
+        # Только на глубине MAX_PREFIX: все (подсказка, ключ) с ключами длиннее префикса,
+        # чтобы более длинный запрос проверялся целиком
+        self.longer: list[tuple] = []
+
+
+class PrefixIndex:
+    # Префиксное дерево: в каждом узле заранее лежат лучшие подсказки для этого префикса,
+    # поэтому запрос — это проход по символам и копия готового списка
+    def __init__(self):
+        self._root = _Node()
+        # Добавления, пришедшие во время перестроения, повторяются в новом дереве
+        self._pending: Optional[list[tuple]] = None
+
+    def add(self, kind: str, item_id: int, label: str, popularity: int = 0) -> None:
+        if self._pending is not None:
+            self._pending.append((kind, item_id, label, popularity))
+        entry = (-popularity, label, kind, item_id)
+        normalized = normalize(label)
+        words = normalized.split(" ")
+        # Полное название и каждое слово с начала: «fender strat» и «strat» найдут Stratocaster
+        starts = {" ".join(words[i:]) for i in range(len(words))}
+        for key in starts:
+            node = self._root
+            for char in key[:MAX_PREFIX]:
+                node = node.children.setdefault(char, _Node())
+                self._offer(node, entry)
+            if len(key) > MAX_PREFIX:
+                bisect.insort(node.longer, (entry, key))
+
+    @staticmethod
+    def _offer(node: _Node, entry: tuple) -> None:
+        top = node.top
+        if any(existing[2:] == entry[2:] for existing in top):
+            return
+        if len(top) >= TOP_K and entry >= top[-1]:
+            return
+        bisect.insort(top, entry)
+        del top[TOP_K:]
+
+    def suggest(self, query: str, limit: int = TOP_K) -> list[dict]:
+        query = normalize(query)
+        node = self._root
+        for char in query[:MAX_PREFIX]:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        if len(query) <= MAX_PREFIX:
+            entries = node.top[:limit]
+        else:
+            # Дерево помнит только первые MAX_PREFIX символов: остаток запроса сверяется с ключами
+            entries = []
+            for entry, key in node.longer:
+                if key.startswith(query) and entry not in entries:
+                    entries.append(entry)
+                    if len(entries) == limit:
+                        break
+        return [
+            {"kind": kind, "id": item_id, "label": label}
+            for _, label, kind, item_id in entries
+        ]
+
+    async def build(self, db: AsyncSession) -> None:
+        self._pending = []
+        try:
+            await self._build(db)
+        finally:
+            self._pending = None
+
+    async def _build(self, db: AsyncSession) -> None:
+        # Популярность товара: продано штук + число оценок; бренда и типа — сумма по их товарам
+        sold = (
+            select(OrderItem.product_id, func.sum(OrderItem.quantity).label("sold"))
+            .join(Order, Order.id == OrderItem.order_id)
+            .where(Order.status == OrderStatusEnum.COMPLETED)
+            .group_by(OrderItem.product_id)
+            .subquery()
+        )
+        popularity = (
+            func.coalesce(sold.c.sold, 0) + func.coalesce(ProductRatingStats.rating_count, 0)
+        ).label("popularity")
+        products = (
+            await db.execute(
+                select(Product.id, Product.title, Product.brand_id, Product.music_type_id, popularity)
+                .outerjoin(sold, sold.c.product_id == Product.id)
+                .outerjoin(ProductRatingStats, ProductRatingStats.product_id == Product.id)
+            )
+        ).all()
+        brands = (await db.execute(select(Brand.id, Brand.name))).all()
+        music_types = (await db.execute(select(MusicType.id, MusicType.name))).all()
+
+        brand_popularity: dict[int, int] = {}
+        music_type_popularity: dict[int, int] = {}
+        index = PrefixIndex()
+        for product_id, title, brand_id, music_type_id, product_popularity in products:
+            index.add("product", product_id, title, int(product_popularity))
+            brand_popularity[brand_id] = brand_popularity.get(brand_id, 0) + int(product_popularity) + 1
+            music_type_popularity[music_type_id] = music_type_popularity.get(music_type_id, 0) + int(product_popularity) + 1
+        for brand_id, name in brands:
+            index.add("brand", brand_id, name, brand_popularity.get(brand_id, 0))
+        for music_type_id, name in music_types:
+            index.add("music_type", music_type_id, name, music_type_popularity.get(music_type_id, 0))
+
+        for args in self._pending:
+            index.add(*args)
+        # Подменяем дерево целиком, чтобы запросы не видели наполовину построенный индекс
+        self._root = index._root
+
+    async def run(self) -> None:
+        while True:
+            try:
+                async with async_session_maker() as session:
+                    await self.build(session)
+            except Exception:
+                logger.exception("Не удалось построить индекс автодополнения")
+            await asyncio.sleep(REBUILD_INTERVAL)
+
+
+autocomplete_index = PrefixIndex()
@@ -1,41 +1,63 @@
 import barcode
-from barcode.writer import ImageWriter
-import os
-from app.models import Order, OrderStatusEnum
+from barcode.writer import ImageWriter, SVGWriter
+import asyncio
+import io
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-def generate_order_barcode(order_id: int) -> str:
+BARCODE_MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+# Растеризация PNG идёт в отдельных потоках, чтобы не блокировать цикл событий
+RENDER_WORKERS = 2
+RENDER_CACHE_SIZE = 512
+
+
+def order_barcode_code(order_id: int) -> str:
     code = str(order_id).zfill(12)
     if len(code) != 12 or not code.isdigit():
         raise ValueError("Order ID must be numeric and 12 digits long after zero-filling")
-    # Путь для сохранения: static/barcodes
-    output_dir = os.path.join(os.getcwd(), 'static', 'barcodes')
-    os.makedirs(output_dir, exist_ok=True)  # Создаст папку, если её нет[1][2][3]
-    EAN = barcode.get_barcode_class('ean13')
-    ean = EAN(code, writer=ImageWriter())
-    filename = os.path.join(output_dir, f'order_{order_id}')
-    try:
-        fullname = ean.save(filename)
-    except Exception as e:
-        print(f"Ошибка генерации штрих-кода: {e}")
-        raise
-    # Возвращаем относительный путь для фронта
-    rel_path = f'/static/barcodes/order_{order_id}.png'
-    return rel_path
-
-
-
-# Пример использования в асинхронной функции (например, при создании заказа)
-async def create_order_and_generate_barcode(db, current_user):
-    order = Order(user_id=current_user.id, status=OrderStatusEnum.ORDERED)
-    db.add(order)
-    await db.commit()
-    await db.refresh(order)
-
-    # Генерируем штрихкод и сохраняем путь в поле order.barcode
-    barcode_path = generate_order_barcode(order.id)
-    order.barcode = barcode_path
-    db.add(order)
-    await db.commit()
-    await db.refresh(order)
-
-    return order
+    return code
+
+
+def barcode_url(order_id: int, fmt: str = "svg") -> str:
+    # Штрихкод не хранится: он рисуется по id заказа при первом запросе
+    return f"/order/{order_id}/barcode.{fmt}"
+
+
+def render_order_barcode(order_id: int, fmt: str) -> bytes:
+    writer = ImageWriter() if fmt == "png" else SVGWriter()
+    ean = barcode.get_barcode_class('ean13')(order_barcode_code(order_id), writer=writer)
+    buffer = io.BytesIO()
+    ean.write(buffer)
+    return buffer.getvalue()
+
+
+class BarcodeRenderer:
+    # Ограниченный пул потоков для отрисовки и LRU готовых байтов;
+    # одновременные запросы одного штрихкода ждут одну отрисовку
+    def __init__(self, workers: int = RENDER_WORKERS, maxsize: int = RENDER_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="barcode")
+        self._cache: OrderedDict = OrderedDict()
+        self._inflight: dict[tuple, asyncio.Future] = {}
+
+    async def get(self, order_id: int, fmt: str) -> bytes:
+        key = (order_id, fmt)
+        content = self._cache.get(key)
+        if content is not None:
+            self._cache.move_to_end(key)
+            return content
+
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().run_in_executor(self._executor, render_order_barcode, order_id, fmt)
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        content = await asyncio.shield(future)
+
+        self._cache[key] = content
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        return content
+
+
+barcode_renderer = BarcodeRenderer()
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Iterable, Union
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import async_session_maker
+from app.http_cache import purge_downstream
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+Loader = Callable[[AsyncSession], Awaitable[Any]]
+Tags = Union[Iterable[str], Callable[[Any], Iterable[str]]]
+
+
+def make_key(namespace: str, **params) -> tuple:
+    # Нормализованный ключ: пустые параметры отбрасываются, порядок не важен
+    return (namespace,) + tuple(sorted((k, v) for k, v in params.items() if v is not None))
+
+
+def product_tags(*product_ids: int) -> list[str]:
+    return [f"product:{product_id}" for product_id in product_ids]
+
+
+class QueryCache:
+    # Ограниченный LRU-кэш с TTL; записи помечаются тегами для точечной инвалидации.
+    # После TTL запись ещё stale_ttl секунд отдаётся как устаревшая, пока идёт фоновое обновление
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, stale_ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._tags: dict[str, set] = {}
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+        self._refreshing: dict[Hashable, asyncio.Task] = {}
+        self._listeners: list[Callable[[tuple], None]] = []
+        # Часы инвалидаций: растут при каждой инвалидации, для тега запоминается момент последней.
+        # Результат загрузки не попадает в кэш, только если за время загрузки сбросили один из его тегов
+        self._generation = 0
+        self._tag_generations: dict[str, int] = {}
+        self.stats = {
+            "hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+            "refresh_errors": 0,
+        }
+
+    def get(self, key: Hashable) -> Any:
+        entry = self._lookup(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.stats["misses"] += 1
+            return MISSING
+        self.stats["hits"] += 1
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, tags: Iterable[str] = ()) -> None:
+        if key in self._entries:
+            self._drop(key)
+        tags = frozenset(tags)
+        self._entries[key] = (time.monotonic() + self.ttl, value, tags)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            self._drop(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    async def get_or_load(self, key: Hashable, loader: Loader, db: AsyncSession, tags: Tags = ()) -> Any:
+        entry = self._lookup(key)
+        if entry is not None:
+            fresh_until, value, _ = entry
+            if fresh_until >= time.monotonic():
+                self.stats["hits"] += 1
+            else:
+                self.stats["stale_hits"] += 1
+                self._schedule_refresh(key, loader, tags)
+            return value
+
+        self.stats["misses"] += 1
+        # Одновременные промахи по одному ключу ждут первый запрос, а не идут в БД параллельно
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        generation = self._generation
+        try:
+            value = await loader(db)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            future.exception()  # ошибка уже передана ожидающим, не логируем её повторно
+            raise
+        else:
+            resolved = frozenset(self._resolve_tags(tags, value))
+            if not self.invalidated_since(generation, resolved):
+                self.set(key, value, resolved)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    @property
+    def generation(self) -> int:
+        # Для загрузчиков вне get_or_load: запомнить до запроса в БД и проверить invalidated_since перед set()
+        return self._generation
+
+    def invalidated_since(self, generation: int, tags: Iterable[str]) -> bool:
+        return any(self._tag_generations.get(tag, 0) > generation for tag in tags)
+
+    def invalidate(self, *tags: str) -> None:
+        self._generation += 1
+        for tag in tags:
+            self._tag_generations[tag] = self._generation
+            for key in list(self._tags.get(tag, ())):
+                self._drop(key)
+                self.stats["invalidations"] += 1
+        for listener in self._listeners:
+            listener(tags)
+
+    def add_invalidation_listener(self, listener: Callable[[tuple], None]) -> None:
+        # Например, очистка внешнего кэша по тем же тегам
+        self._listeners.append(listener)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._tags.clear()
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "size": len(self._entries), "maxsize": self.maxsize}
+
+    def _lookup(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] + self.stale_ttl < time.monotonic():
+            self._drop(key)
+            self.stats["expirations"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _schedule_refresh(self, key: Hashable, loader: Loader, tags: Tags) -> None:
+        if key in self._refreshing:
+            return
+        task = asyncio.get_running_loop().create_task(self._refresh(key, loader, tags))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+
+    async def _refresh(self, key: Hashable, loader: Loader, tags: Tags) -> None:
+        # Фоновое обновление идёт в собственной сессии: сессия запроса к этому моменту закрыта
+        generation = self._generation
+        try:
+            async with async_session_maker() as session:
+                value = await loader(session)
+        except Exception:
+            self.stats["refresh_errors"] += 1
+            logger.warning("Не удалось обновить запись кэша %r", key, exc_info=True)
+            return
+        resolved = frozenset(self._resolve_tags(tags, value))
+        if key in self._entries and not self.invalidated_since(generation, resolved):
+            self.set(key, value, resolved)
+
+    @staticmethod
+    def _resolve_tags(tags: Tags, value: Any) -> Iterable[str]:
+        return tags(value) if callable(tags) else tags
+
+    def _drop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+catalog_cache = QueryCache(maxsize=2048, ttl=60.0, stale_ttl=300.0)
+catalog_cache.add_invalidation_listener(purge_downstream)
@@ -0,0 +1,97 @@
+from sqlalchemy import select, update, delete, case, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.barcode.barcodegenerate import barcode_url
+from app.models import Order, OrderItem, OrderStatusEnum, Product
+
+
+async def get_or_create_cart(db: AsyncSession, user_id: int) -> int:
+    # Открытая корзина у пользователя одна (частичный уникальный индекс), поэтому
+    # создание и поиск — один INSERT ... ON CONFLICT, без гонки между параллельными запросами
+    stmt = insert(Order).values(user_id=user_id, status=OrderStatusEnum.ORDERED)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Order.user_id],
+        # Предикат литералом: с параметром PostgreSQL не сопоставит его с частичным индексом
+        index_where=text("status = 'ORDERED'"),
+        set_={"user_id": stmt.excluded.user_id},
+    ).returning(Order.id, Order.barcode)
+    order_id, barcode = (await db.execute(stmt)).one()
+    if barcode is None:
+        # Только для только что созданной корзины
+        await db.execute(update(Order).where(Order.id == order_id).values(barcode=barcode_url(order_id)))
+    return order_id
+
+
+async def find_cart(db: AsyncSession, user_id: int):
+    result = await db.execute(
+        select(Order.id).where(Order.user_id == user_id, Order.status == OrderStatusEnum.ORDERED)
+    )
+    return result.scalar()
+
+
+async def add_cart_lines(db: AsyncSession, order_id: int, demand: dict[int, int]):
+    # Новые позиции и прибавки к существующим — одним многострочным INSERT ... ON CONFLICT.
+    # Товар в demand встречается один раз: PostgreSQL не даёт обновить строку дважды за оператор
+    if not demand:
+        return []
+    stmt = insert(OrderItem).values([
+        {"order_id": order_id, "product_id": product_id, "quantity": quantity}
+        for product_id, quantity in demand.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[OrderItem.order_id, OrderItem.product_id],
+        set_={"quantity": OrderItem.quantity + stmt.excluded.quantity},
+    ).returning(OrderItem.id, OrderItem.order_id, OrderItem.product_id, OrderItem.quantity)
+    return (await db.execute(stmt)).all()
+
+
+async def upsert_cart_line(db: AsyncSession, order_id: int, product_id: int, quantity: int):
+    # Новая позиция или прибавка к количеству существующей — одним оператором
+    return (await add_cart_lines(db, order_id, {product_id: quantity}))[0]
+
+
+async def set_cart_quantities(db: AsyncSession, order_id: int, quantities: dict[int, int]) -> dict[int, int]:
+    # Новые количества для позиций корзины одним UPDATE; возвращает {id позиции: id товара} обновлённых
+    if not quantities:
+        return {}
+    result = await db.execute(
+        update(OrderItem)
+        .where(OrderItem.order_id == order_id, OrderItem.id.in_(list(quantities)))
+        .values(quantity=case(quantities, value=OrderItem.id))
+        .returning(OrderItem.id, OrderItem.product_id)
+        .execution_options(synchronize_session=False)
+    )
+    return dict(result.all())
+
+
+async def remove_cart_lines(db: AsyncSession, order_id: int, item_ids: set[int]) -> dict[int, int]:
+    # Возвращает {id позиции: id товара} удалённых позиций
+    if not item_ids:
+        return {}
+    result = await db.execute(
+        delete(OrderItem)
+        .where(OrderItem.order_id == order_id, OrderItem.id.in_(list(item_ids)))
+        .returning(OrderItem.id, OrderItem.product_id)
+        .execution_options(synchronize_session=False)
+    )
+    return dict(result.all())
+
+
+async def cart_summary(db: AsyncSession, order_id: int) -> dict:
+    # Позиции корзины и итог по текущим ценам — один запрос с join, без графа товаров
+    result = await db.execute(
+        select(OrderItem.id, OrderItem.order_id, OrderItem.product_id, OrderItem.quantity, Product.price)
+        .join(Product, Product.id == OrderItem.product_id)
+        .where(OrderItem.order_id == order_id)
+        .order_by(OrderItem.id)
+    )
+    rows = result.all()
+    return {
+        "order_id": order_id,
+        "items": [
+            {"id": row.id, "order_id": row.order_id, "product_id": row.product_id, "quantity": row.quantity}
+            for row in rows
+        ],
+        "items_count": sum(row.quantity for row in rows),
+        "total_amount": sum(row.quantity * row.price for row in rows),
+    }
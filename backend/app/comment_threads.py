@@ -0,0 +1,82 @@
+from typing import Optional
+from sqlalchemy import select, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import Comment, User
+
+# Предел глубины на случай очень длинных цепочек ответов
+MAX_THREAD_DEPTH = 50
+
+THREAD_COLUMNS = (
+    Comment.id,
+    Comment.user_id,
+    Comment.product_id,
+    Comment.content,
+    Comment.created_at,
+    Comment.parent_id,
+    Comment.rating,
+    User.name.label("user_name"),
+    # Сам аватар не читаем, только признак его наличия
+    User.avatar.isnot(None).label("user_has_avatar"),
+)
+
+
+def avatar_url(user_id: int) -> str:
+    return f"/login/profile/avatar/{user_id}"
+
+
+def _node(row) -> dict:
+    return {
+        "id": row.id,
+        "user_id": row.user_id,
+        "product_id": row.product_id,
+        "content": row.content,
+        "created_at": row.created_at,
+        "parent_id": row.parent_id,
+        "rating": row.rating,
+        "depth": row.depth,
+        "user": {
+            "id": row.user_id,
+            "name": row.user_name,
+            "avatar_url": avatar_url(row.user_id) if row.user_has_avatar else None,
+        },
+        "children": [],
+    }
+
+
+async def load_subtrees(db: AsyncSession, root_ids: list[int], max_depth: Optional[int] = None) -> list[dict]:
+    # Корни и все их ответы (до max_depth уровней) одним рекурсивным запросом;
+    # строки сразу превращаются в словари, ORM-объекты не создаются
+    if not root_ids:
+        return []
+    depth_limit = min(max_depth, MAX_THREAD_DEPTH) if max_depth is not None else MAX_THREAD_DEPTH
+
+    tree = (
+        select(Comment.id, literal(0).label("depth"))
+        .where(Comment.id.in_(root_ids))
+        .cte("thread", recursive=True)
+    )
+    tree = tree.union_all(
+        select(Comment.id, tree.c.depth + 1)
+        .join(tree, Comment.parent_id == tree.c.id)
+        .where(tree.c.depth < depth_limit)
+    )
+    result = await db.execute(
+        select(*THREAD_COLUMNS, tree.c.depth)
+        .join(tree, tree.c.id == Comment.id)
+        .join(User, User.id == Comment.user_id)
+        .order_by(tree.c.depth, Comment.created_at, Comment.id)
+    )
+    return [_node(row) for row in result]
+
+
+def nest(nodes: list[dict]) -> list[dict]:
+    # Раскладывает плоский список по children; возвращает узлы без родителя в списке
+    by_id = {node["id"]: node for node in nodes}
+    roots = []
+    for node in nodes:
+        parent = by_id.get(node["parent_id"])
+        if parent is not None:
+            parent["children"].append(node)
+        else:
+            roots.append(node)
+    return roots
@@ -0,0 +1,84 @@
+from typing import Optional
+from sqlalchemy import select, update, delete, exists, literal, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import Comment, CommentRating
+
+# Повтор нужен, только если параллельный запрос того же пользователя успел вставить голос
+MAX_ATTEMPTS = 3
+
+
+def toggle_vote_statement(comment_id: int, user_id: int, value: int):
+    # Один оператор: голос пользователя добавляется, меняется или снимается (повторный клик),
+    # а рейтинг отзыва сдвигается на разницу в той же транзакции
+    votes = CommentRating.__table__
+    # Строка отзыва блокируется раньше строки голоса: иначе CTE, дописывающие голос уже после
+    # UPDATE отзыва, взаимоблокируются с параллельным голосом того же пользователя
+    target = (
+        select(Comment.id)
+        .where(Comment.id == comment_id)
+        .with_for_update(key_share=True)
+        .cte("target")
+    )
+    prev = (
+        select(votes.c.id, votes.c.value)
+        .where(votes.c.user_id == user_id, votes.c.comment_id == comment_id, exists(select(target.c.id)))
+        .with_for_update()
+        .cte("prev")
+    )
+    removed = (
+        delete(votes)
+        .where(votes.c.id.in_(select(prev.c.id).where(prev.c.value == value)))
+        .returning(votes.c.value)
+        .cte("removed")
+    )
+    changed = (
+        update(votes)
+        .where(votes.c.id.in_(select(prev.c.id).where(prev.c.value != value)))
+        .values(value=value)
+        .returning(votes.c.id)
+        .cte("changed")
+    )
+    added = (
+        pg_insert(votes)
+        .from_select(
+            ["user_id", "comment_id", "value"],
+            select(literal(user_id), literal(comment_id), literal(value)).where(
+                exists(select(target.c.id)), ~exists(select(prev.c.id))
+            ),
+        )
+        .on_conflict_do_nothing(index_elements=["user_id", "comment_id"])
+        .returning(votes.c.id, votes.c.value)
+        .cte("added")
+    )
+    delta = (
+        func.coalesce(select(-removed.c.value).scalar_subquery(), 0)
+        + func.coalesce(
+            select(literal(value) - prev.c.value).where(prev.c.id.in_(select(changed.c.id))).scalar_subquery(), 0
+        )
+        + func.coalesce(select(added.c.value).scalar_subquery(), 0)
+    )
+    return (
+        update(Comment)
+        .where(Comment.id == comment_id)
+        .values(rating=Comment.rating + delta)
+        .returning(
+            Comment.rating,
+            select(changed.c.id).union_all(select(added.c.id)).scalar_subquery().label("vote_id"),
+            # Голоса не было в снимке, но вставка упёрлась в конфликт — его вставил параллельный запрос
+            (~exists(select(prev.c.id)) & ~exists(select(added.c.id))).label("conflicted"),
+        )
+    )
+
+
+async def toggle_comment_vote(db: AsyncSession, comment_id: int, user_id: int, value: int) -> tuple[Optional[int], Optional[int]]:
+    # Возвращает (id голоса или None, если голос снят; новый рейтинг или None, если отзыва нет).
+    # Коммит — на вызывающей стороне
+    for _ in range(MAX_ATTEMPTS):
+        result = await db.execute(toggle_vote_statement(comment_id, user_id, value))
+        row = result.first()
+        if row is None:
+            return None, None
+        if not row.conflicted:
+            return row.vote_id, row.rating
+    raise RuntimeError("Не удалось применить голос: конфликт параллельных запросов")
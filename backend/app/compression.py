@@ -0,0 +1,146 @@
+import gzip
+from typing import Optional
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # без пакета brotli отдаём только gzip
+    brotli = None
+
+# Меньшие ответы не сжимаем: выигрыш меньше накладных расходов
+MIN_SIZE = 1024
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/", "image/svg+xml")
+
+# Уровни для сжатия на лету и для тел из кэша: последние сжимаются один раз, можно сильнее
+GZIP_LEVEL = 6
+GZIP_LEVEL_CACHED = 9
+BROTLI_QUALITY = 4
+BROTLI_QUALITY_CACHED = 9
+
+SUPPORTED_ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+# Статистика по маршрутам: сколько ответов сжато и сколько байт сэкономлено
+compression_stats: dict[str, dict] = {}
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in SUPPORTED_ENCODINGS:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def is_compressible(media_type: Optional[str], size: int) -> bool:
+    return size >= MIN_SIZE and bool(media_type) and media_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def compress(content: bytes, encoding: str, cached: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(content, quality=BROTLI_QUALITY_CACHED if cached else BROTLI_QUALITY)
+    return gzip.compress(content, compresslevel=GZIP_LEVEL_CACHED if cached else GZIP_LEVEL, mtime=0)
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    # У сжатого представления свой сильный ETag: "<хеш>-gzip", "<хеш>-br"
+    return etag[:-1] + "-" + encoding + '"' if etag.endswith('"') else etag
+
+
+def strip_encoding(etag: str) -> str:
+    for encoding in SUPPORTED_ENCODINGS:
+        suffix = "-" + encoding + '"'
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+
+def route_path(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or scope.get("path", "")
+
+
+def record_compression(path: str, original: int, compressed: int) -> None:
+    stats = compression_stats.setdefault(path, {"responses": 0, "bytes_in": 0, "bytes_out": 0})
+    stats["responses"] += 1
+    stats["bytes_in"] += original
+    stats["bytes_out"] += compressed
+
+
+def compression_snapshot() -> dict:
+    return {
+        path: {**stats, "bytes_saved": stats["bytes_in"] - stats["bytes_out"]}
+        for path, stats in sorted(compression_stats.items())
+    }
+
+
+def _add_vary(headers: MutableHeaders) -> None:
+    if "accept-encoding" not in headers.get("vary", "").lower():
+        headers.add_vary_header("Accept-Encoding")
+
+
+class CompressionMiddleware:
+    # Сжимает готовые ответы целиком. Потоковые ответы и уже сжатые
+    # (тела из кэша, см. http_cache.conditional_response) пропускаются как есть
+    def __init__(self, app, minimum_size: int = MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            headers = MutableHeaders(scope=start)
+            body = message.get("body", b"")
+            if (
+                message.get("more_body", False)
+                or "content-encoding" in headers
+                or len(body) < self.minimum_size
+                or not is_compressible(headers.get("content-type"), len(body))
+            ):
+                if headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES):
+                    _add_vary(headers)
+                await send(start)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            record_compression(route_path(scope), len(body), len(compressed))
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            _add_vary(headers)
+            if "etag" in headers:
+                headers["ETag"] = encoded_etag(headers["etag"], encoding)
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
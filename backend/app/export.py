@@ -0,0 +1,88 @@
+import csv
+import io
+import json
+from typing import AsyncIterator
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from app.database import async_session_maker
+from app.models import Product, Brand, MusicType, ProductImage, ProductRatingStats
+
+EXPORT_BATCH_SIZE = 500
+
+EXPORT_FIELDS = [
+    "id", "title", "description", "price", "quantity", "created_at",
+    "brand_id", "brand", "music_type_id", "music_type",
+    "image", "images", "avg_rating", "rating_count",
+]
+
+
+def export_query():
+    # Только нужные колонки, без ORM-объектов: строки не копятся в identity map.
+    # Картинки — коррелированным подзапросом по индексу product_id для каждой строки,
+    # а не агрегатом по всей таблице: первая строка уходит клиенту сразу
+    images = (
+        select(func.array_agg(aggregate_order_by(ProductImage.image_path, ProductImage.id)))
+        .where(ProductImage.product_id == Product.id)
+        .scalar_subquery()
+    )
+    return (
+        select(
+            Product.id,
+            Product.title,
+            Product.description,
+            Product.price,
+            Product.quantity,
+            Product.created_at,
+            Product.brand_id,
+            Brand.name.label("brand"),
+            Product.music_type_id,
+            MusicType.name.label("music_type"),
+            Product.image,
+            images.label("images"),
+            func.coalesce(ProductRatingStats.avg_rating, 0.0).label("avg_rating"),
+            func.coalesce(ProductRatingStats.rating_count, 0).label("rating_count"),
+        )
+        .outerjoin(Brand, Brand.id == Product.brand_id)
+        .outerjoin(MusicType, MusicType.id == Product.music_type_id)
+        .outerjoin(ProductRatingStats, ProductRatingStats.product_id == Product.id)
+        .order_by(Product.id)
+    )
+
+
+async def stream_rows(query) -> AsyncIterator[list]:
+    # Серверный курсор в собственной сессии: сессия из Depends закрывается до начала отдачи тела
+    async with async_session_maker() as session:
+        result = await session.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for partition in result.mappings().partitions():
+            yield partition
+
+
+def _row_dict(row) -> dict:
+    data = dict(row)
+    data["images"] = list(data["images"] or [])
+    if data["created_at"] is not None:
+        data["created_at"] = data["created_at"].isoformat()
+    return data
+
+
+async def ndjson_chunks(query) -> AsyncIterator[bytes]:
+    async for rows in stream_rows(query):
+        yield "".join(
+            json.dumps(_row_dict(row), ensure_ascii=False) + "\n" for row in rows
+        ).encode()
+
+
+async def csv_chunks(query) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    async for rows in stream_rows(query):
+        for row in rows:
+            data = _row_dict(row)
+            data["images"] = " ".join(data["images"])
+            writer.writerow(data)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
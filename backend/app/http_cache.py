@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import logging
+import os
+import urllib.request
+from dataclasses import dataclass, field
+from typing import Iterable
+from fastapi import Request
+from fastapi.responses import Response
+from app.compression import choose_encoding, compress, encoded_etag, is_compressible, record_compression, route_path, strip_encoding
+
+logger = logging.getLogger(__name__)
+
+# Политики Cache-Control по типам ответов
+CACHE_CONTROL_PRODUCT = "public, max-age=60, stale-while-revalidate=300"
+CACHE_CONTROL_CATALOG_LIST = "public, max-age=30, stale-while-revalidate=120"
+CACHE_CONTROL_DICTIONARY = "public, max-age=300, stale-while-revalidate=600"
+CACHE_CONTROL_AVATAR = "public, no-cache"
+# Свободный остаток меняется с каждым резервом корзины
+CACHE_CONTROL_NO_STORE = "no-store"
+# Штрихкод однозначно определяется id заказа и не меняется
+CACHE_CONTROL_BARCODE = "public, max-age=31536000, immutable"
+
+# Адрес кэширующего прокси перед API; если не задан, очистка не выполняется
+PURGE_BASE_URL = os.getenv("CACHE_PURGE_URL")
+
+
+@dataclass(frozen=True)
+class RenderedBody:
+    content: bytes
+    etag: str
+    media_type: str = "application/json"
+    # Теги кэша, посчитанные при рендеринге (например, id товаров на странице)
+    tags: frozenset = frozenset()
+    # Сжатые варианты тела, считаются при первом запросе и живут вместе с записью кэша
+    encodings: dict = field(default_factory=dict, compare=False, repr=False)
+
+    def encoded(self, encoding: str) -> bytes:
+        content = self.encodings.get(encoding)
+        if content is None:
+            content = compress(self.content, encoding, cached=True)
+            self.encodings[encoding] = content
+        return content
+
+
+def make_etag(content: bytes) -> str:
+    return '"' + hashlib.sha256(content).hexdigest()[:32] + '"'
+
+
+def render(content: bytes, media_type: str = "application/json", tags: Iterable[str] = ()) -> RenderedBody:
+    return RenderedBody(content=content, etag=make_etag(content), media_type=media_type, tags=frozenset(tags))
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in (strip_encoding(value.strip()) for value in header.split(","))
+
+
+def conditional_response(request: Request, body: RenderedBody, cache_control: str) -> Response:
+    headers = {"ETag": body.etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    encoding = None
+    if is_compressible(body.media_type, len(body.content)):
+        encoding = choose_encoding(request.headers.get("accept-encoding"))
+    if encoding is not None:
+        headers["ETag"] = encoded_etag(body.etag, encoding)
+    if etag_matches(request, body.etag):
+        return Response(status_code=304, headers=headers)
+    if encoding is None:
+        return Response(content=body.content, media_type=body.media_type, headers=headers)
+
+    content = body.encoded(encoding)
+    record_compression(route_path(request.scope), len(body.content), len(content))
+    headers["Content-Encoding"] = encoding
+    return Response(content=content, media_type=body.media_type, headers=headers)
+
+
+# --- Очистка внешнего кэша ---
+
+def purge_paths_for_tags(tags: Iterable[str]) -> list[str]:
+    paths = []
+    for tag in tags:
+        if tag.startswith("product:"):
+            paths.append(f"/products/{tag.split(':', 1)[1]}")
+        elif tag == "brands":
+            paths.append("/brand")
+        elif tag == "music_types":
+            paths.append("/products/music_types")
+        elif tag.startswith("avatar:"):
+            paths.append(f"/login/profile/avatar/{tag.split(':', 1)[1]}")
+    return paths
+
+
+def _send_purge(url: str) -> None:
+    request = urllib.request.Request(url, method="PURGE")
+    with urllib.request.urlopen(request, timeout=2):
+        pass
+
+
+async def _purge(paths: list[str]) -> None:
+    for path in paths:
+        try:
+            await asyncio.to_thread(_send_purge, PURGE_BASE_URL.rstrip("/") + path)
+        except Exception as exc:
+            logger.warning("Не удалось очистить %s во внешнем кэше: %s", path, exc)
+
+
+_purge_tasks: set = set()
+
+
+def purge_downstream(tags: Iterable[str]) -> None:
+    # Не блокирует запрос: PURGE уходит в фоне, ошибки только логируются
+    if not PURGE_BASE_URL:
+        return
+    paths = purge_paths_for_tags(tags)
+    if not paths:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    task = loop.create_task(_purge(paths))
+    _purge_tasks.add(task)
+    task.add_done_callback(_purge_tasks.discard)
@@ -0,0 +1,77 @@
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import timedelta
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import async_session_maker
+from app.models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+# Сколько живёт ключ: повтор в этом окне получает сохранённый ответ
+IDEMPOTENCY_WINDOW = timedelta(hours=24)
+PURGE_INTERVAL = 3600.0
+
+
+def request_fingerprint(payload) -> str:
+    # Тот же ключ с другим телом запроса — ошибка клиента, а не повтор
+    raw = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+async def claim_key(db: AsyncSession, user_id: int, key: str, fingerprint: str) -> bool:
+    # Занимает ключ в текущей транзакции (просроченный ключ занимается заново).
+    # Параллельный запрос с тем же ключом ждёт на уникальном индексе, пока первый не завершится:
+    # после коммита он получит False и сохранённый ответ, после отката — займёт ключ сам
+    stmt = pg_insert(IdempotencyKey).values(user_id=user_id, key=key, request_hash=fingerprint)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[IdempotencyKey.user_id, IdempotencyKey.key],
+        set_={
+            "request_hash": stmt.excluded.request_hash,
+            "response_status": None,
+            "response_body": None,
+            "created_at": func.now(),
+        },
+        where=IdempotencyKey.created_at < func.now() - IDEMPOTENCY_WINDOW,
+    ).returning(IdempotencyKey.user_id)
+    result = await db.execute(stmt)
+    return result.first() is not None
+
+
+async def get_stored_response(db: AsyncSession, user_id: int, key: str):
+    result = await db.execute(
+        select(IdempotencyKey.request_hash, IdempotencyKey.response_status, IdempotencyKey.response_body)
+        .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+    )
+    return result.first()
+
+
+async def save_response(db: AsyncSession, user_id: int, key: str, status_code: int, body: dict) -> None:
+    # Пишется в той же транзакции, что и сам заказ: ответ сохраняется, только если заказ оформлен
+    await db.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+        .values(response_status=status_code, response_body=json.dumps(body, ensure_ascii=False))
+    )
+
+
+async def purge_expired_keys(db: AsyncSession) -> int:
+    result = await db.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.created_at < func.now() - IDEMPOTENCY_WINDOW)
+    )
+    await db.commit()
+    return result.rowcount
+
+
+async def run_purge() -> None:
+    # Фоновая чистка просроченных ключей
+    while True:
+        try:
+            async with async_session_maker() as session:
+                await purge_expired_keys(session)
+        except Exception:
+            logger.exception("Не удалось удалить просроченные ключи идемпотентности")
+        await asyncio.sleep(PURGE_INTERVAL)
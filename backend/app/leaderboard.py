@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+from pydantic import TypeAdapter
+from sqlalchemy import select, func, cast, Float
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from app.database import async_session_maker
+from app.http_cache import RenderedBody, render
+from app.models import Product, ProductRatingStats
+from app.schemas import LeaderboardEntry
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_SIZE = 200
+# Товары с меньшим числом оценок в рейтинг не попадают
+MIN_VOTES = 3
+# Вес априорного среднего: столько «виртуальных» оценок со средним по каталогу добавляется к каждому товару
+PRIOR_VOTES = 10
+REFRESH_INTERVAL = 60.0
+# После новой оценки пересчёт откладывается, чтобы серия оценок дала один пересчёт
+DIRTY_DELAY = 5.0
+MAX_RENDERED_PAGES = 64
+
+entry_list_adapter = TypeAdapter(list[LeaderboardEntry])
+
+
+class Leaderboard:
+    # Рейтинг лучших товаров в памяти: байесовская оценка
+    # score = (v * R + m * C) / (v + m), где v — число оценок, R — среднее товара,
+    # m — PRIOR_VOTES, C — среднее по всем оценкам каталога
+    def __init__(self):
+        self.entries: list[LeaderboardEntry] = []
+        self.refreshed_at: Optional[datetime] = None
+        self._pages: dict[tuple, RenderedBody] = {}
+        self._dirty = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    async def refresh(self, db: AsyncSession) -> None:
+        async with self._lock:
+            totals = await db.execute(
+                select(func.sum(ProductRatingStats.rating_sum), func.sum(ProductRatingStats.rating_count))
+            )
+            rating_sum, rating_count = totals.one()
+            global_mean = (rating_sum or 0) / rating_count if rating_count else 0.0
+
+            stats = ProductRatingStats
+            score = (
+                (cast(stats.rating_sum, Float) + PRIOR_VOTES * global_mean)
+                / (stats.rating_count + PRIOR_VOTES)
+            ).label("score")
+            result = await db.execute(
+                select(Product, stats.avg_rating, stats.rating_count, score)
+                .join(stats, stats.product_id == Product.id)
+                .where(stats.rating_count >= MIN_VOTES)
+                .options(
+                    selectinload(Product.images),
+                    selectinload(Product.brand),
+                    selectinload(Product.music_type)
+                )
+                .order_by(score.desc(), Product.id)
+                .limit(LEADERBOARD_SIZE)
+            )
+            entries = []
+            for product, avg_rating, votes, product_score in result.all():
+                product.avg_rating = avg_rating
+                product.rating_count = votes
+                product.score = product_score
+                entries.append(LeaderboardEntry.model_validate(product))
+
+            self.entries = entries
+            self._pages = {}
+            self.refreshed_at = datetime.now(timezone.utc)
+
+    def page(self, min_rating: float, skip: int, limit: int) -> RenderedBody:
+        key = (min_rating, skip, limit)
+        body = self._pages.get(key)
+        if body is None:
+            selected = [entry for entry in self.entries if entry.avg_rating >= min_rating]
+            body = render(entry_list_adapter.dump_json(selected[skip:skip + limit]))
+            if len(self._pages) >= MAX_RENDERED_PAGES:
+                self._pages.clear()
+            self._pages[key] = body
+        return body
+
+    def mark_dirty(self) -> None:
+        self._dirty.set()
+
+    async def run(self) -> None:
+        # Фоновый цикл: пересчёт при старте, по расписанию и вскоре после изменения оценок
+        while True:
+            self._dirty.clear()
+            try:
+                async with async_session_maker() as session:
+                    await self.refresh(session)
+            except Exception:
+                logger.exception("Не удалось обновить рейтинг лучших товаров")
+            try:
+                await asyncio.wait_for(self._dirty.wait(), timeout=REFRESH_INTERVAL)
+                await asyncio.sleep(DIRTY_DELAY)
+            except asyncio.TimeoutError:
+                pass
+
+
+leaderboard = Leaderboard()
@@ -3,6 +3,13 @@ from fastapi.responses import JSONResponse
 from app.routers import register, auth, adminpanel, product, order, favorite, brand, supplies, sold
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
+from app.leaderboard import leaderboard
+from app.autocomplete import autocomplete_index
+from app.idempotency import run_purge
+from app.stock import run_sweeper
+from app.compression import CompressionMiddleware
+import asyncio
 import logging
 import os
 
@@ -12,7 +19,21 @@ logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
 )
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Фоновые задачи приложения
+    tasks = [
+        asyncio.create_task(leaderboard.run()),
+        asyncio.create_task(autocomplete_index.run()),
+        asyncio.create_task(run_purge()),
+        asyncio.create_task(run_sweeper()),
+    ]
+    yield
+    for task in tasks:
+        task.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -25,6 +46,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Сжатие ответов gzip/brotli по Accept-Encoding
+app.add_middleware(CompressionMiddleware)
+
 
 
 
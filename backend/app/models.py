@@ -1,7 +1,7 @@
-from sqlalchemy import Column, Integer, String, Text, Float, DateTime, ForeignKey, UniqueConstraint, LargeBinary, Enum
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy import Column, Integer, String, Text, Float, DateTime, ForeignKey, UniqueConstraint, LargeBinary, Enum, Index, text
+from sqlalchemy.orm import relationship, backref, deferred, column_property
 import enum
-from sqlalchemy.dialects.postgresql import BYTEA # Для хранения файлов в PostgreSQL
+from sqlalchemy.dialects.postgresql import BYTEA, TSVECTOR # Для хранения файлов в PostgreSQL
 from .database import Base
 
 
@@ -68,9 +68,14 @@ class Product(Base):
     price = Column(Float, nullable=False)
     image = Column(String(255))
     quantity = Column(Integer, nullable=False, server_default='0')
+    # Сколько единиц удержано корзинами, см. app/stock.py
+    reserved_quantity = Column(Integer, nullable=False, server_default='0')
     created_at = Column(DateTime, server_default='now()')
     music_type_id = Column(Integer, ForeignKey('music_types.id'))
     brand_id = Column(Integer, ForeignKey('brands.id'))
+    search_vector = deferred(Column(TSVECTOR))  # поисковый документ, см. app/search.py
+    # Свободный остаток: сколько ещё можно положить в корзину или купить
+    available = column_property(quantity - reserved_quantity)
     music_type = relationship("MusicType", back_populates="products")
     brand = relationship("Brand", back_populates="products")
     comments = relationship("Comment", back_populates="product")
@@ -79,11 +84,21 @@ class Product(Base):
     supply_items = relationship("SupplyItem", back_populates="product")
     favorites = relationship("Favorite", back_populates="product", cascade="all, delete-orphan", single_parent=True)
     images = relationship("ProductImage", back_populates="product", cascade="all, delete-orphan")
+    rating_stats = relationship("ProductRatingStats", back_populates="product", uselist=False)
+
+    # Составные индексы для keyset-пагинации каталога (колонка сортировки + id)
+    __table_args__ = (
+        Index('ix_products_price_id', 'price', 'id'),
+        Index('ix_products_created_at_id', 'created_at', 'id'),
+        Index('ix_products_title_id', 'title', 'id'),
+        Index('ix_products_search_vector', 'search_vector', postgresql_using='gin'),
+        Index('ix_products_title_trgm', 'title', postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'}),
+    )
 
 class ProductImage(Base):
     __tablename__ = "product_images"
     id = Column(Integer, primary_key=True, index=True)
-    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), nullable=False, index=True)
     image_path = Column(String(255), nullable=False)  
     product = relationship("Product", back_populates="images")
 
@@ -96,12 +111,19 @@ class Comment(Base):
     product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
     content = Column(Text, nullable=False)
     created_at = Column(DateTime, server_default='now()')
-    rating = Column(Integer, default=0, nullable=False)
+    rating = Column(Integer, default=0, server_default='0', nullable=False)  # сумма голосов, см. comment_ratings
     parent_id = Column(Integer, ForeignKey('comments.id'), nullable=True)
     user = relationship("User", back_populates="comments")
     product = relationship("Product", back_populates="comments")
     parent = relationship("Comment", remote_side=[id], backref=backref("children", cascade="all, delete-orphan", lazy="selectin"))
 
+    # Страницы корневых отзывов товара (по рейтингу и по дате) и поиск ответов по родителю
+    __table_args__ = (
+        Index('ix_comments_product_rating_id', 'product_id', 'rating', 'id', postgresql_where=text('parent_id IS NULL')),
+        Index('ix_comments_product_created_at_id', 'product_id', 'created_at', 'id', postgresql_where=text('parent_id IS NULL')),
+        Index('ix_comments_parent_id', 'parent_id'),
+    )
+
 class CommentRating(Base):
     __tablename__ = 'comment_ratings'
     id = Column(Integer, primary_key=True, index=True)
@@ -135,18 +157,34 @@ class Order(Base):
     created_at = Column(DateTime, server_default='now()')
     status = Column(Enum(OrderStatusEnum), nullable=False, default=OrderStatusEnum.ORDERED)
     barcode = Column(String(255), nullable=True)
+    # Итоги фиксируются при оформлении; у корзины они пустые
+    total_amount = Column(Float, nullable=True)
+    items_count = Column(Integer, nullable=True)
     user = relationship("User", back_populates="orders")
     order_items = relationship("OrderItem", back_populates="order")
 
+    # Не больше одной открытой корзины на пользователя
+    __table_args__ = (
+        Index('uq_orders_user_open_cart', 'user_id', unique=True, postgresql_where=text("status = 'ORDERED'")),
+        # Постраничная история заказов пользователя
+        Index('ix_orders_user_status_created_at_id', 'user_id', 'status', 'created_at', 'id'),
+    )
+
 class OrderItem(Base):
     __tablename__ = 'order_items'
     id = Column(Integer, primary_key=True, index=True)
     order_id = Column(Integer, ForeignKey('orders.id'), nullable=False)
     product_id = Column(Integer, ForeignKey('products.id'), nullable=False)
     quantity = Column(Integer, nullable=False, server_default='1')
+    # Цена за единицу на момент покупки; у позиций корзины пустая
+    unit_price = Column(Float, nullable=True)
     order = relationship("Order", back_populates="order_items")
     product = relationship("Product", back_populates="order_items")
 
+    __table_args__ = (
+        UniqueConstraint('order_id', 'product_id', name='uq_order_items_order_product'),
+    )
+
 class Rating(Base):
     __tablename__ = 'ratings'
     id = Column(Integer, primary_key=True, index=True)
@@ -160,6 +198,47 @@ class Rating(Base):
         UniqueConstraint('user_id', 'product_id', name='unique_user_product_rating'),
     )
 
+class ProductRatingStats(Base):
+    # Агрегаты оценок товара, обновляются вместе с записью в ratings
+    __tablename__ = 'product_rating_stats'
+    product_id = Column(Integer, ForeignKey('products.id', ondelete="CASCADE"), primary_key=True)
+    rating_sum = Column(Integer, nullable=False, server_default='0')
+    rating_count = Column(Integer, nullable=False, server_default='0')
+    avg_rating = Column(Float, nullable=False, server_default='0', index=True)
+    stars_1 = Column(Integer, nullable=False, server_default='0')
+    stars_2 = Column(Integer, nullable=False, server_default='0')
+    stars_3 = Column(Integer, nullable=False, server_default='0')
+    stars_4 = Column(Integer, nullable=False, server_default='0')
+    stars_5 = Column(Integer, nullable=False, server_default='0')
+    product = relationship("Product", back_populates="rating_stats")
+
+class ProductPurchase(Base):
+    # Индекс покупок: пара (пользователь, товар) записывается при оформлении заказа,
+    # по ней проверяется право оставить отзыв и оценку
+    __tablename__ = 'product_purchases'
+    user_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"), primary_key=True)
+    product_id = Column(Integer, ForeignKey('products.id', ondelete="CASCADE"), primary_key=True)
+    first_order_id = Column(Integer, ForeignKey('orders.id', ondelete="SET NULL"), nullable=True)
+    purchased_at = Column(DateTime, server_default='now()')
+
+class StockReservation(Base):
+    # Мягкий резерв товара корзиной до expires_at; просроченные снимает фоновая задача (app/stock.py)
+    __tablename__ = 'stock_reservations'
+    order_id = Column(Integer, ForeignKey('orders.id', ondelete="CASCADE"), primary_key=True)
+    product_id = Column(Integer, ForeignKey('products.id', ondelete="CASCADE"), primary_key=True)
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class IdempotencyKey(Base):
+    # Ключ идемпотентности оформления заказа и сохранённый ответ на первый запрос с ним
+    __tablename__ = 'idempotency_keys'
+    user_id = Column(Integer, ForeignKey('users.id', ondelete="CASCADE"), primary_key=True)
+    key = Column(String(255), primary_key=True)
+    request_hash = Column(String(64), nullable=False)
+    response_status = Column(Integer, nullable=True)
+    response_body = Column(Text, nullable=True)
+    created_at = Column(DateTime, server_default='now()', index=True)
+
 class Supplier(Base):
     __tablename__ = 'suppliers'
     id = Column(Integer, primary_key=True, index=True)
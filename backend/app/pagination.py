@@ -0,0 +1,73 @@
+import base64
+import json
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+
+# Диапазон колонок Integer: больше не примет PostgreSQL
+INT_MIN, INT_MAX = -2**31, 2**31 - 1
+
+
+# Курсор — непрозрачная строка: base64(json([ключ сортировки, значение, id]))
+def encode_cursor(sort_key: str, value, row_id: int) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort_key, value, row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _cursor_value(value, sort_column):
+    # Значение из курсора приводится к типу колонки сортировки; чужой тип — ValueError
+    if value is None:
+        return None
+    try:
+        python_type = sort_column.type.python_type
+    except NotImplementedError:
+        python_type = None
+    if python_type is datetime:
+        if not isinstance(value, str):
+            raise ValueError
+        value = datetime.fromisoformat(value)
+        # Колонки без часового пояса: курсор с поясом собран не нами
+        if value.tzinfo is not None:
+            raise ValueError
+        return value
+    if python_type is float:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError
+        return float(value)
+    if python_type is not None:
+        if isinstance(value, bool) or not isinstance(value, python_type):
+            raise ValueError
+        if python_type is int and not INT_MIN <= value <= INT_MAX:
+            raise ValueError
+        return value
+    if isinstance(value, (bool, list, dict)):
+        raise ValueError
+    return value
+
+
+def decode_cursor(cursor: str, sort_key: str, sort_column):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+    if cursor_sort != sort_key or not isinstance(row_id, int) or isinstance(row_id, bool) or not INT_MIN <= row_id <= INT_MAX:
+        raise HTTPException(status_code=400, detail="Курсор не соответствует сортировке")
+    try:
+        value = _cursor_value(value, sort_column)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Курсор не соответствует сортировке")
+    return value, row_id
+
+
+def apply_keyset(query, sort_column, id_column, descending: bool, after=None):
+    # after — (значение, id) последней строки предыдущей страницы, см. decode_cursor
+    if after is not None:
+        value, row_id = after
+        key = tuple_(sort_column, id_column)
+        query = query.where(key < tuple_(value, row_id) if descending else key > tuple_(value, row_id))
+    if descending:
+        return query.order_by(sort_column.desc(), id_column.desc())
+    return query.order_by(sort_column.asc(), id_column.asc())
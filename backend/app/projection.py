@@ -0,0 +1,118 @@
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+from fastapi import HTTPException
+from pydantic import TypeAdapter
+from sqlalchemy.orm import load_only, selectinload
+from app.models import Product
+from app.schemas import ProductImageRead, BrandRead, MusicTypeRead, ProductReadWithRating
+
+# Поля товара, которые можно запросить через ?fields=
+PRODUCT_COLUMNS = {
+    "id": Product.id,
+    "title": Product.title,
+    "description": Product.description,
+    "price": Product.price,
+    "quantity": Product.quantity,
+    "image": Product.image,
+    "brand_id": Product.brand_id,
+    "music_type_id": Product.music_type_id,
+}
+
+# Связи, которые встраиваются только по ?include= (или если названы в ?fields=)
+PRODUCT_RELATIONS = {
+    "images": (Product.images, ProductImageRead),
+    "brand": (Product.brand, BrandRead),
+    "music_type": (Product.music_type, MusicTypeRead),
+}
+
+projection_adapter = TypeAdapter(Any)
+
+# Полный ответ списка: поля и их порядок — как у ProductReadWithRating, у связей — как у их схем
+FULL_PRODUCT_FIELDS = tuple(
+    (name, tuple(PRODUCT_RELATIONS[name][1].model_fields) if name in PRODUCT_RELATIONS else None)
+    for name in ProductReadWithRating.model_fields
+)
+
+
+def _split(value: Optional[str]) -> list[str]:
+    return [name.strip() for name in (value or "").split(",") if name.strip()]
+
+
+@dataclass(frozen=True)
+class Projection:
+    columns: tuple[str, ...]
+    relations: tuple[str, ...]
+    # Вычисляемые поля эндпоинта (например, avg_rating в списке), если запрошены
+    extras: tuple[str, ...] = ()
+
+    @property
+    def cache_key(self) -> str:
+        return ",".join(self.columns + self.extras) + "|" + ",".join(self.relations)
+
+    def options(self) -> list:
+        # В SELECT попадают только запрошенные колонки, незапрошенные связи не загружаются вовсе
+        options = [load_only(*(PRODUCT_COLUMNS[name] for name in self.columns))]
+        options += [selectinload(PRODUCT_RELATIONS[name][0]) for name in self.relations]
+        return options
+
+    def dump(self, product: Product, **extras) -> dict:
+        data = {name: getattr(product, name) for name in self.columns}
+        for name in self.extras:
+            data[name] = extras.get(name)
+        for name in self.relations:
+            value = getattr(product, name)
+            schema = PRODUCT_RELATIONS[name][1]
+            if isinstance(value, list):
+                data[name] = [schema.model_validate(item) for item in value]
+            else:
+                data[name] = schema.model_validate(value) if value is not None else None
+        return data
+
+
+def _loaded(obj) -> dict:
+    # Уже загруженные значения колонок строки: без дескрипторов ORM и без валидации from_attributes
+    return obj.__dict__
+
+
+def dump_product(product: Product, **extras) -> dict:
+    # Словарь, который projection_adapter сериализует в тот же JSON, что и ProductReadWithRating.
+    # Всё нужное загружено запросом списка (колонки и selectinload связей); чего нет в строке — None
+    state = _loaded(product)
+    data = {}
+    for name, fields in FULL_PRODUCT_FIELDS:
+        if name in extras:
+            data[name] = extras[name]
+        elif fields is None:
+            data[name] = state.get(name)
+        else:
+            value = state.get(name)
+            if isinstance(value, list):
+                data[name] = [{field: _loaded(item).get(field) for field in fields} for item in value]
+            else:
+                data[name] = {field: _loaded(value).get(field) for field in fields} if value is not None else None
+    return data
+
+
+def parse_projection(fields: Optional[str], include: Optional[str], extras: Iterable[str] = ()) -> Optional[Projection]:
+    # Без fields и include — полный ответ, как раньше
+    if fields is None and include is None:
+        return None
+
+    extras = tuple(extras)
+    requested = _split(fields) if fields is not None else list(PRODUCT_COLUMNS) + list(extras)
+    included = _split(include)
+    unknown = [
+        name for name in requested + included
+        if name not in PRODUCT_COLUMNS and name not in PRODUCT_RELATIONS and name not in extras
+    ]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные поля: {', '.join(unknown)}")
+
+    # id нужен всегда: по нему строятся курсор и теги кэша
+    columns = ["id"] + [name for name in PRODUCT_COLUMNS if name != "id" and name in requested]
+    relations = [name for name in PRODUCT_RELATIONS if name in requested or name in included]
+    return Projection(
+        columns=tuple(columns),
+        relations=tuple(relations),
+        extras=tuple(name for name in extras if name in requested),
+    )
@@ -0,0 +1,37 @@
+from typing import Iterable
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import ProductPurchase
+
+
+async def record_purchases(db: AsyncSession, user_id: int, order_id: int, product_ids: Iterable[int]) -> None:
+    # Вызывается при оформлении заказа в той же транзакции; повторные покупки ничего не меняют
+    rows = [
+        {"user_id": user_id, "product_id": product_id, "first_order_id": order_id}
+        for product_id in set(product_ids)
+    ]
+    if not rows:
+        return
+    await db.execute(
+        insert(ProductPurchase).values(rows).on_conflict_do_nothing(index_elements=["user_id", "product_id"])
+    )
+
+
+async def has_purchased(db: AsyncSession, user_id: int, product_id: int) -> bool:
+    # Одно обращение к первичному ключу (user_id, product_id)
+    result = await db.execute(
+        select(ProductPurchase.product_id).where(
+            ProductPurchase.user_id == user_id, ProductPurchase.product_id == product_id
+        )
+    )
+    return result.scalar() is not None
+
+
+async def purchased_product_ids(db: AsyncSession, user_id: int, product_ids: Iterable[int]) -> set[int]:
+    result = await db.execute(
+        select(ProductPurchase.product_id).where(
+            ProductPurchase.user_id == user_id, ProductPurchase.product_id.in_(list(product_ids))
+        )
+    )
+    return set(result.scalars().all())
@@ -0,0 +1,61 @@
+from typing import Optional
+from sqlalchemy import select, cast, Float, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import ProductRatingStats
+
+STAR_VALUES = (1, 2, 3, 4, 5)
+
+
+async def apply_rating_change(
+    db: AsyncSession,
+    product_id: int,
+    old_value: Optional[int],
+    new_value: int,
+) -> None:
+    # Дельта к агрегатам: новая оценка или замена старой. Коммит делает вызывающий код,
+    # поэтому агрегаты меняются в той же транзакции, что и запись в ratings
+    sum_delta = new_value - (old_value or 0)
+    count_delta = 0 if old_value is not None else 1
+    star_deltas = {value: 0 for value in STAR_VALUES}
+    star_deltas[new_value] += 1
+    if old_value is not None:
+        star_deltas[old_value] -= 1
+
+    table = ProductRatingStats.__table__
+    stmt = insert(ProductRatingStats).values(
+        product_id=product_id,
+        rating_sum=sum_delta,
+        rating_count=count_delta,
+        avg_rating=float(new_value),
+        **{f"stars_{value}": max(delta, 0) for value, delta in star_deltas.items()},
+    )
+    new_sum = table.c.rating_sum + sum_delta
+    new_count = table.c.rating_count + count_delta
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.product_id],
+        set_={
+            "rating_sum": new_sum,
+            "rating_count": new_count,
+            "avg_rating": func.coalesce(cast(new_sum, Float) / func.nullif(new_count, 0), 0),
+            **{
+                f"stars_{value}": table.c[f"stars_{value}"] + delta
+                for value, delta in star_deltas.items() if delta
+            },
+        },
+    )
+    await db.execute(stmt)
+
+
+async def get_rating_stats(db: AsyncSession, product_id: int) -> dict:
+    result = await db.execute(
+        select(ProductRatingStats).where(ProductRatingStats.product_id == product_id)
+    )
+    stats = result.scalars().first()
+    if not stats:
+        return {"average": 0, "count": 0, "histogram": {str(value): 0 for value in STAR_VALUES}}
+    return {
+        "average": stats.avg_rating,
+        "count": stats.rating_count,
+        "histogram": {str(value): getattr(stats, f"stars_{value}") for value in STAR_VALUES},
+    }
@@ -24,6 +24,10 @@ from app.schemas import (
     SupplyCreate, SupplyRead, SupplyListResponse, SupplyItemRead, SupplyItemCreate,   
     OrderItemRead, OrderItemCreate, CategoryProductsResponse
 )
+from app.search import refresh_search_document
+from app.compression import compression_snapshot
+from app.cache import catalog_cache, product_tags
+from app.autocomplete import autocomplete_index
 
 router = APIRouter(
     prefix="/admin",
@@ -50,6 +54,18 @@ def apply_sort(query, model, sort: str):
             query = query.order_by(sort_column)
     return query
 
+# ======================== Кэш каталога ========================
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    return catalog_cache.snapshot()
+
+
+@router.get("/compression/stats")
+async def get_compression_stats():
+    # Сжатые ответы и сэкономленные байты по маршрутам
+    return compression_snapshot()
+
 # ======================== Поставщики ========================
 
 @router.get("/suppliers", response_model=SupplierListResponse)
@@ -143,6 +159,7 @@ async def create_supply_item(
     product = await db.get(Product, item.product_id)
     product.quantity += item.quantity
     await db.commit()
+    catalog_cache.invalidate(*product_tags(item.product_id))
     # Возвращаем созданный объект с подгруженными связями
     result = await db.execute(
         select(SupplyItem)
@@ -209,7 +226,11 @@ async def create_product(
         image=image_url
     )
     db.add(db_product)
+    await db.flush()
+    await refresh_search_document(db, db_product.id)
     await db.commit()
+    catalog_cache.invalidate("catalog")
+    autocomplete_index.add("product", db_product.id, db_product.title)
     await db.refresh(db_product)
 
     # Подгружаем связанные объекты для корректной сериализации
@@ -252,6 +273,7 @@ async def upload_product_images(
         saved_images.append(product_image)
 
     await db.commit()
+    catalog_cache.invalidate(*product_tags(product_id))
     return {"uploaded": len(saved_images)}
 
     
@@ -284,6 +306,7 @@ async def create_category(category: CategoryCreate, db: AsyncSession = Depends(g
     db_category = Category(**category.dict())
     db.add(db_category)
     await db.commit()
+    catalog_cache.invalidate("categories")
     await db.refresh(db_category)
     return db_category
 
@@ -356,7 +379,9 @@ async def create_music_type(music_type: MusicTypeCreate, db: AsyncSession = Depe
     db_music_type = MusicType(**music_type.dict())
     db.add(db_music_type)
     await db.commit()
+    catalog_cache.invalidate("music_types")
     await db.refresh(db_music_type)
+    autocomplete_index.add("music_type", db_music_type.id, db_music_type.name)
     return db_music_type
 
 # ======================== Бренды ========================
@@ -394,7 +419,9 @@ async def create_brand(brand: BrandCreate, db: AsyncSession = Depends(get_db)):
     db_brand = Brand(**brand.dict())
     db.add(db_brand)
     await db.commit()
+    catalog_cache.invalidate("brands")
     await db.refresh(db_brand)
+    autocomplete_index.add("brand", db_brand.id, db_brand.name)
     return db_brand
 
 # ======================== Комментарии ========================
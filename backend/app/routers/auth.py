@@ -1,7 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, func
 from sqlalchemy.orm import selectinload
 from passlib.context import CryptContext
 from jose import jwt
@@ -12,6 +12,7 @@ from app.schemas import UserUpdate, PasswordUpdate, UserResponse
 from app.auth.security import SECRET_KEY, ALGORITHM, create_access_token, verify_password
 from app.auth.dependencies import get_current_user
 from fastapi.responses import Response
+from app.http_cache import etag_matches, purge_downstream, CACHE_CONTROL_AVATAR
 import logging
 import os
 
@@ -113,19 +114,29 @@ async def upload_avatar(
     avatar_data = await file.read()
     current_user.avatar = avatar_data
     await db.commit()
+    purge_downstream([f"avatar:{current_user.id}"])
     await db.refresh(current_user)
     return {"status": "success"}
 
 @router.get("/profile/avatar/{user_id}")
 async def get_avatar(
     user_id: int,
+    request: Request,
     db: AsyncSession = Depends(get_db),
 ):
-    stmt = select(User).where(User.id == user_id)
-    result = await db.execute(stmt)
-    user = result.scalar_one_or_none()
-    if not user:
+    # Сначала сверяем хэш, посчитанный в БД: при совпадении ETag сам файл не читаем
+    result = await db.execute(
+        select(User.id, func.md5(User.avatar)).where(User.id == user_id)
+    )
+    row = result.first()
+    if not row:
         raise HTTPException(404, "User not found")
-    if not user.avatar:
+    if row[1] is None:
         raise HTTPException(404, "Avatar not found")
-    return Response(content=user.avatar, media_type="image/jpeg")
+    etag = f'"{row[1]}"'
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL_AVATAR}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    result = await db.execute(select(User.avatar).where(User.id == user_id))
+    return Response(content=result.scalar_one(), media_type="image/jpeg", headers=headers)
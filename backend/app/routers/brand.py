@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 from sqlalchemy.orm import selectinload
@@ -6,17 +6,25 @@ from app.database import get_db
 from app.models import Product, Comment, Rating, User, CommentRating, ProductImage, OrderItem, Order, OrderStatusEnum, Brand, MusicType
 from app.schemas import ProductRead, ProductCreate, CommentRead, RatingRead, RatingCreate, CommentCreate, CommentRatingCreate, CommentRatingRead, BrandRead, MusicTypeRead, ProductReadWithRating, BrandRead, MusicTypeRead
 from app.auth.dependencies import get_current_user
+from app.cache import catalog_cache, make_key
+from app.http_cache import render, conditional_response, CACHE_CONTROL_DICTIONARY
+from pydantic import TypeAdapter
 from typing import List, Optional
 
 
 
 router = APIRouter(prefix="/brand", tags=["Brands"])
 
+brand_list_adapter = TypeAdapter(List[BrandRead])
+
 @router.get("", response_model=List[BrandRead])
-async def list_brands(db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Brand))
-    brands = result.scalars().all()
-    return brands
+async def list_brands(request: Request, db: AsyncSession = Depends(get_db)):
+    async def load(session: AsyncSession):
+        result = await session.execute(select(Brand))
+        return render(brand_list_adapter.dump_json(result.scalars().all()))
+
+    body = await catalog_cache.get_or_load(make_key("brands"), load, db, tags=("brands",))
+    return conditional_response(request, body, CACHE_CONTROL_DICTIONARY)
 
 @router.get("/{brand_id}", response_model=BrandRead)
 async def get_brand(brand_id: int, db: AsyncSession = Depends(get_db)):
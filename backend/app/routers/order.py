@@ -1,13 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Body
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Path, Request, Query, Header
+from fastapi.responses import JSONResponse
+from typing import Optional
+import json
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update, case
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import selectinload
 from app.database import get_db
 from app.auth.dependencies import get_current_user
 from app.models import Order, OrderItem, Product, User, OrderStatusEnum
-from app.schemas import OrderRead, OrderItemRead, OrderItemCreate, OrderItemUpdate, CheckoutRequest
+from app.schemas import OrderRead, OrderItemCreate, OrderItemUpdate, CheckoutRequest, CartLineRead, ProductRead, OrderHistoryPage, OrderSummary, OrderLineRead, CartBulkRequest, CartSummary
 import random
-from app.barcode.barcodegenerate import generate_order_barcode
+from app.barcode.barcodegenerate import barcode_url, barcode_renderer, BARCODE_MEDIA_TYPES
+from app.http_cache import render, conditional_response, CACHE_CONTROL_BARCODE
+from app.cache import catalog_cache, product_tags
+from app.purchases import record_purchases
+from app.stock import deduct_stock, lock_products, sync_reservations, release_reservations
+from app.cart import get_or_create_cart, find_cart, upsert_cart_line, add_cart_lines, set_cart_quantities, remove_cart_lines, cart_summary
+from app.pagination import encode_cursor, decode_cursor, apply_keyset
+from app.idempotency import request_fingerprint, claim_key, get_stored_response, save_response
 
 
 router = APIRouter(prefix="/order", tags=["Order"])
@@ -48,194 +59,284 @@ async def get_order_barcode(
     return {"barcode_url": order.barcode}
 
 
-@router.post("/items", response_model=OrderItemRead, status_code=status.HTTP_201_CREATED)
-async def add_to_order(
-    item: OrderItemCreate,
-    current_user: User = Depends(get_current_user),
+@router.get("/{order_id}/barcode.{fmt}")
+async def get_order_barcode_image(
+    order_id: int,
+    request: Request,
+    fmt: str = Path(..., pattern="^(png|svg)$"),
     db: AsyncSession = Depends(get_db)
 ):
-    
-    product = await db.get(Product, item.product_id)
-    if not product:
-        raise HTTPException(status_code=404, detail="Товар не найден")
-
-    
-    result = await db.execute(
-        select(Order)
-        .options(
-            selectinload(Order.order_items)
-            .selectinload(OrderItem.product)
-            .selectinload(Product.images),
-            selectinload(Order.order_items)
-            .selectinload(OrderItem.product)
-            .selectinload(Product.brand),
-            selectinload(Order.order_items)
-            .selectinload(OrderItem.product)
-            .selectinload(Product.music_type),
-            selectinload(Order.user)
-        )
-        .where(Order.user_id == current_user.id, Order.status == OrderStatusEnum.ORDERED)
+    result = await db.execute(select(Order.id).where(Order.id == order_id))
+    if result.scalar() is None:
+        raise HTTPException(status_code=404, detail="Заказ не найден")
+    content = await barcode_renderer.get(order_id, fmt)
+    return conditional_response(request, render(content, BARCODE_MEDIA_TYPES[fmt]), CACHE_CONTROL_BARCODE)
+
+
+async def stock_shortfall(db: AsyncSession, failed: list[int]) -> HTTPException:
+    # Ошибка для товаров, которые не удалось списать или зарезервировать (транзакция уже откачена)
+    result = await db.execute(select(Product.id, Product.title).where(Product.id.in_(failed)))
+    titles = dict(result.all())
+    missing = [product_id for product_id in failed if product_id not in titles]
+    if missing:
+        return HTTPException(status_code=404, detail=f"Товар с id {missing[0]} не найден")
+    return HTTPException(
+        status_code=400,
+        detail=f"Недостаточно товара {', '.join(titles[product_id] for product_id in failed)} на складе"
     )
-    order = result.scalars().first()
 
-    
-    if not order:
-        order = Order(user_id=current_user.id, status=OrderStatusEnum.ORDERED)
-        db.add(order)
-        await db.flush()
-        
-        barcode_path = generate_order_barcode(order.id)
-        order.barcode = barcode_path
-        await db.commit()  
-        await db.refresh(order)
-
-    # Проверяем, есть ли уже такой товар в корзине
-    result = await db.execute(
-        select(OrderItem)
-        .where(OrderItem.order_id == order.id, OrderItem.product_id == item.product_id)
-    )
-    existing_item = result.scalars().first()
 
-    if existing_item:
-        # Если товар уже есть — увеличиваем количество
-        existing_item.quantity += item.quantity
-        db.add(existing_item)
-        await db.commit()
-        await db.refresh(existing_item)
-
-        # Загружаем связи для сериализации
-        result = await db.execute(
-            select(OrderItem)
-            .options(
-                selectinload(OrderItem.order),
-                selectinload(OrderItem.product).selectinload(Product.images),
-                selectinload(OrderItem.product).selectinload(Product.brand),
-                selectinload(OrderItem.product).selectinload(Product.music_type)
-            )
-            .where(OrderItem.id == existing_item.id)
-        )
-        item_with_relations = result.scalars().first()
-        return item_with_relations
-    else:
-        # Если товара нет — создаём новый элемент заказа
-        new_item = OrderItem(
-            order_id=order.id,
-            product_id=item.product_id,
-            quantity=item.quantity,
+@router.post("/items", response_model=CartLineRead, status_code=status.HTTP_201_CREATED)
+async def add_to_order(
+    item: OrderItemCreate,
+    include: Optional[str] = Query(None, pattern="^product$", description="product — встроить в ответ товар"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    # Корзина, позиция и резерв — несколько коротких операторов и один коммит.
+    # Нехватку свободного остатка видно сразу, а не при оформлении
+    try:
+        order_id = await get_or_create_cart(db, current_user.id)
+        free = await lock_products(db, [item.product_id])
+        if item.product_id not in free:
+            await db.rollback()
+            raise HTTPException(status_code=404, detail="Товар не найден")
+        line = await upsert_cart_line(db, order_id, item.product_id, item.quantity)
+        failed = await sync_reservations(
+            db, order_id, free, {item.product_id: line.quantity}, {item.product_id: item.quantity}
         )
-        db.add(new_item)
+        if failed:
+            await db.rollback()
+            raise await stock_shortfall(db, failed)
         await db.commit()
-        await db.refresh(new_item)
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Товар не найден")
 
-        # Загружаем связи для сериализации
+    response = CartLineRead.model_validate(line)
+    if include:
         result = await db.execute(
-            select(OrderItem)
-            .options(
-                selectinload(OrderItem.order),
-                selectinload(OrderItem.product).selectinload(Product.images),
-                selectinload(OrderItem.product).selectinload(Product.brand),
-                selectinload(OrderItem.product).selectinload(Product.music_type)
-            )
-            .where(OrderItem.id == new_item.id)
+            select(Product)
+            .options(selectinload(Product.images), selectinload(Product.brand), selectinload(Product.music_type))
+            .where(Product.id == line.product_id)
         )
-        item_with_relations = result.scalars().first()
-        return item_with_relations
+        response.product = ProductRead.model_validate(result.scalars().first())
+    return response
 
 
+@router.post("/items/bulk", response_model=CartSummary)
+async def bulk_update_order_items(
+    data: CartBulkRequest,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    # Все изменения корзины за один запрос и одну транзакцию: по оператору на каждый вид операции.
+    # Сначала удаления (они важнее изменения количества той же позиции), затем количества, затем добавления
+    removed_ids = {op.item_id for op in data.operations if op.op == "remove"}
+    quantities = {op.item_id: op.quantity for op in data.operations if op.op == "set" and op.item_id not in removed_ids}
+    demand: dict[int, int] = {}
+    for op in data.operations:
+        if op.op == "add":
+            demand[op.product_id] = demand.get(op.product_id, 0) + op.quantity
+
+    order_id = await get_or_create_cart(db, current_user.id) if demand else await find_cart(db, current_user.id)
+    if order_id is None:
+        raise HTTPException(status_code=404, detail="Заказ (корзина) не найдена")
 
+    # Позиции корзины: по ним известны товары удаляемых и изменяемых позиций
+    result = await db.execute(select(OrderItem.id, OrderItem.product_id).where(OrderItem.order_id == order_id))
+    lines = dict(result.all())
+    missing = sorted((removed_ids | set(quantities)) - set(lines))
+    if missing:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail=f"Позиции {', '.join(map(str, missing))} не найдены в заказе")
+
+    try:
+        # Товары блокируются до удаления, изменения и вставки позиций — как в добавлении и PATCH,
+        # иначе блокировки строк корзины и товаров берутся в разном порядке (см. lock_products)
+        touched = {lines[item_id] for item_id in removed_ids | set(quantities)} | set(demand)
+        free = await lock_products(db, touched)
+        unknown = [product_id for product_id in demand if product_id not in free]
+        if unknown:
+            await db.rollback()
+            raise HTTPException(status_code=404, detail=f"Товар с id {unknown[0]} не найден")
+
+        # Количества до изменений: обязательный резерв — только прирост позиции
+        result = await db.execute(select(OrderItem.product_id, OrderItem.quantity).where(OrderItem.order_id == order_id))
+        before = dict(result.all())
+        removed = await remove_cart_lines(db, order_id, removed_ids)
+        updated = await set_cart_quantities(db, order_id, quantities)
+        if len(removed) < len(removed_ids) or len(updated) < len(quantities):
+            # Позицию успели удалить параллельным запросом
+            await db.rollback()
+            missing = sorted((removed_ids - set(removed)) | (set(quantities) - set(updated)))
+            raise HTTPException(status_code=404, detail=f"Позиции {', '.join(map(str, missing))} не найдены в заказе")
+        await add_cart_lines(db, order_id, demand)
+        summary = await cart_summary(db, order_id)
+
+        # Резерв каждого затронутого товара подводится к итоговому количеству в корзине
+        after = {item["product_id"]: item["quantity"] for item in summary["items"]}
+        targets = {product_id: after.get(product_id, 0) for product_id in touched}
+        required = {product_id: max(0, targets[product_id] - before.get(product_id, 0)) for product_id in touched}
+        failed = await sync_reservations(db, order_id, free, targets, required)
+        if failed:
+            await db.rollback()
+            raise await stock_shortfall(db, failed)
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Товар не найден")
+    return summary
 
 
 @router.post("/me/checkout", status_code=status.HTTP_200_OK)
 async def checkout_order(
     data: CheckoutRequest = Body(...),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    # Получаем текущий заказ-корзину пользователя
+    # Повтор с тем же Idempotency-Key получает сохранённый ответ: остатки и штрихкоды не трогаются
+    if idempotency_key is not None:
+        fingerprint = request_fingerprint(sorted(set(data.items_ids)))
+        if not await claim_key(db, current_user.id, idempotency_key, fingerprint):
+            stored = await get_stored_response(db, current_user.id, idempotency_key)
+            if stored.request_hash != fingerprint:
+                raise HTTPException(status_code=422, detail="Ключ идемпотентности уже использован с другим запросом")
+            if stored.response_status is None:
+                raise HTTPException(status_code=409, detail="Запрос с этим ключом ещё выполняется")
+            return JSONResponse(
+                status_code=stored.response_status,
+                content=json.loads(stored.response_body),
+                headers={"Idempotent-Replayed": "true"},
+            )
+
+    # Выбранные позиции текущей корзины пользователя — без графа товаров
     result = await db.execute(
-        select(Order)
-        .options(
-            selectinload(Order.order_items),
-            selectinload(Order.order_items).selectinload(OrderItem.product).selectinload(Product.images),
-            selectinload(Order.order_items).selectinload(OrderItem.product).selectinload(Product.brand),
-            selectinload(Order.order_items).selectinload(OrderItem.product).selectinload(Product.music_type)
-        )
+        select(OrderItem.id, OrderItem.order_id, OrderItem.product_id, OrderItem.quantity)
+        .join(Order)
         .where(Order.user_id == current_user.id, Order.status == OrderStatusEnum.ORDERED)
     )
-    order = result.scalars().first()
-    if not order or not order.order_items:
+    cart_items = result.all()
+    if not cart_items:
         raise HTTPException(status_code=400, detail="Корзина пуста")
 
     # Фильтруем выбранные товары по переданным id
-    selected_items = [item for item in order.order_items if item.id in data.items_ids]
+    selected_items = [item for item in cart_items if item.id in data.items_ids]
     if not selected_items:
         raise HTTPException(status_code=400, detail="Не выбраны товары для покупки")
 
+    demand: dict[int, int] = {}
     for item in selected_items:
-        product_result = await db.execute(select(Product).where(Product.id == item.product_id))
-        product = product_result.scalars().first()
-        if not product:
-            raise HTTPException(status_code=404, detail=f"Товар с id {item.product_id} не найден")
-        if product.quantity < item.quantity:
-            raise HTTPException(status_code=400, detail=f"Недостаточно товара {product.title} на складе")
-        product.quantity -= item.quantity
-        
-
-
-    # Создаем новый заказ со статусом COMPLETED
-    completed_order = Order(user_id=current_user.id, status=OrderStatusEnum.COMPLETED)
+        demand[item.product_id] = demand.get(item.product_id, 0) + item.quantity
+
+    # Резерв корзины по покупаемым товарам переходит в списание: сначала снимаем его,
+    # затем условно списываем одним оператором из свободного остатка; заодно получаем цены покупки
+    await release_reservations(db, cart_items[0].order_id, demand)
+    prices = await deduct_stock(db, demand)
+    if len(prices) < len(demand):
+        await db.rollback()
+        raise await stock_shortfall(db, [product_id for product_id in demand if product_id not in prices])
+
+    # Создаем новый заказ со статусом COMPLETED и сразу с итогами — истории не нужно их пересчитывать
+    completed_order = Order(
+        user_id=current_user.id,
+        status=OrderStatusEnum.COMPLETED,
+        total_amount=sum(quantity * prices[product_id] for product_id, quantity in demand.items()),
+        items_count=sum(demand.values()),
+    )
     db.add(completed_order)
     await db.flush()  # чтобы получить id нового заказа
 
-    # Переносим выбранные товары в новый заказ
-    for item in selected_items:
-        item.order_id = completed_order.id
-
-    # Если остались товары в старом заказе, они остаются в корзине
-    # Если все товары были выбраны, то корзина станет пустой
-
-    await db.commit()
-    await db.refresh(completed_order)
-
-    # Создаем новую пустую корзину для пользователя, если старый заказ теперь пуст
-    result = await db.execute(
-        select(OrderItem).where(OrderItem.order_id == order.id)
+    # Переносим выбранные товары в новый заказ одним UPDATE, фиксируя цену за единицу;
+    # невыбранные остаются в корзине
+    await db.execute(
+        update(OrderItem)
+        .where(OrderItem.id.in_([item.id for item in selected_items]))
+        .values(order_id=completed_order.id, unit_price=case(prices, value=OrderItem.product_id))
+        .execution_options(synchronize_session=False)
     )
-    remaining_items = result.scalars().first()
-    if not remaining_items:
-        order.status = OrderStatusEnum.ORDERED  # можно оставить, но корзина пустая
-        # Можно также удалить пустой заказ, если хотите
-
-    # Генерируем штрихкод для нового заказа
-    barcode_path = generate_order_barcode(completed_order.id)
-    completed_order.barcode = barcode_path
-    await db.commit()
-    await db.refresh(completed_order)
+    # Покупки — в индекс для проверки права на отзывы и оценки
+    await record_purchases(db, current_user.id, completed_order.id, demand)
+    # Штрихкод рисуется по запросу, здесь только ссылка на него
+    completed_order.barcode = barcode_url(completed_order.id)
 
-    return {
+    response = {
         "success": True,
         "new_order_id": completed_order.id,
         "message": "Заказ оформлен!"
     }
+    if idempotency_key is not None:
+        await save_response(db, current_user.id, idempotency_key, status.HTTP_200_OK, response)
 
-@router.get("/me/history", response_model=list[OrderRead])
+    await db.commit()
+    # Остатки изменились — сбрасываем закэшированные карточки и страницы с этими товарами
+    catalog_cache.invalidate(*product_tags(*demand))
+
+    return response
+
+@router.get("/me/history", response_model=OrderHistoryPage)
 async def get_order_history(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor предыдущей страницы"),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
+    # Только шапки заказов с сохранёнными итогами, страницами по (created_at, id)
+    query = select(
+        Order.id, Order.created_at, Order.status, Order.barcode, Order.total_amount, Order.items_count
+    ).where(Order.user_id == current_user.id, Order.status == OrderStatusEnum.COMPLETED)
+    after = decode_cursor(cursor, "created_at", Order.created_at) if cursor else None
+    result = await db.execute(apply_keyset(query, Order.created_at, Order.id, True, after).limit(limit))
+    orders = [
+        OrderSummary(
+            id=row.id,
+            created_at=row.created_at,
+            status=row.status.value,
+            barcode=row.barcode,
+            total_amount=row.total_amount,
+            items_count=row.items_count,
+        )
+        for row in result
+    ]
+
+    next_cursor = None
+    if len(orders) == limit:
+        next_cursor = encode_cursor("created_at", orders[-1].created_at, orders[-1].id)
+    return OrderHistoryPage(data=orders, next_cursor=next_cursor)
+
+
+@router.get("/me/history/{order_id}/items", response_model=list[OrderLineRead])
+async def get_order_history_items(
+    order_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    # Позиции одного заказа — грузятся, когда пользователь его раскрывает
     result = await db.execute(
-        select(Order)
-        .options(
-            selectinload(Order.user),
-            selectinload(Order.order_items).selectinload(OrderItem.product).selectinload(Product.images),
-            selectinload(Order.order_items).selectinload(OrderItem.product).selectinload(Product.brand),
-            selectinload(Order.order_items).selectinload(OrderItem.product).selectinload(Product.music_type)
+        select(Order.id).where(
+            Order.id == order_id, Order.user_id == current_user.id, Order.status == OrderStatusEnum.COMPLETED
         )
-        .where(Order.user_id == current_user.id, Order.status == OrderStatusEnum.COMPLETED)
-        .order_by(Order.created_at.desc())
     )
-    orders = result.scalars().all()
-    return orders
+    if result.scalar() is None:
+        raise HTTPException(status_code=404, detail="Заказ не найден")
+
+    result = await db.execute(
+        select(OrderItem.id, OrderItem.product_id, OrderItem.quantity, OrderItem.unit_price, Product.title, Product.image)
+        .join(Product, Product.id == OrderItem.product_id)
+        .where(OrderItem.order_id == order_id)
+        .order_by(OrderItem.id)
+    )
+    return [
+        OrderLineRead(
+            id=row.id,
+            product_id=row.product_id,
+            quantity=row.quantity,
+            unit_price=row.unit_price,
+            product={"id": row.product_id, "title": row.title, "image": row.image},
+        )
+        for row in result
+    ]
 
 @router.delete("/items/{item_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def remove_from_order(
@@ -251,6 +352,7 @@ async def remove_from_order(
     item = result.scalars().first()
     if not item:
         raise HTTPException(status_code=404, detail="Товар не найден в заказе")
+    await release_reservations(db, item.order_id, [item.product_id])
     await db.delete(item)
     await db.commit()
 
@@ -269,7 +371,19 @@ async def update_order_item(
     order_item = result.scalars().first()
     if not order_item:
         raise HTTPException(status_code=404, detail="Товар не найден в заказе")
-    
+
+    # Резерв позиции подводится к новому количеству; уменьшение проходит всегда
+    product_id = order_item.product_id
+    free = await lock_products(db, [product_id])
+    failed = await sync_reservations(
+        db, order_item.order_id, free,
+        {product_id: item_update.quantity},
+        {product_id: max(0, item_update.quantity - order_item.quantity)},
+    )
+    if failed:
+        await db.rollback()
+        raise await stock_shortfall(db, failed)
+
     order_item.quantity = item_update.quantity  # присваиваем новое количество из запроса
     await db.commit()
 
@@ -1,47 +1,55 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from sqlalchemy.orm import selectinload
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import select, func, case, tuple_
+from sqlalchemy.orm import selectinload, noload
 from app.database import get_db
-from app.models import Product, Comment, Rating, User, CommentRating, ProductImage, OrderItem, Order, OrderStatusEnum, Brand, MusicType
-from app.schemas import ProductRead, ProductCreate, CommentRead, RatingRead, RatingCreate, CommentCreate, CommentRatingCreate, CommentRatingRead, BrandRead, MusicTypeRead, ProductReadWithRating, BrandRead, MusicTypeRead
+from app.models import Product, Comment, Rating, User, ProductImage, Brand, MusicType, ProductRatingStats, Category
+from app.schemas import ProductRead, ProductCreate, RatingRead, RatingCreate, CommentCreate, CommentRatingCreate, CommentRatingRead, BrandRead, MusicTypeRead, ProductReadWithRating, BrandRead, MusicTypeRead, ProductCursorPage, ProductFacetsResponse, LeaderboardEntry, AutocompleteSuggestion, ProductBatchRequest, ProductBatchResponse, CommentCursorPage, CommentCompact, ReviewEligibility, ProductAvailability
 from app.auth.dependencies import get_current_user
-from typing import List, Optional
+from app.pagination import encode_cursor, decode_cursor, apply_keyset
+from app.rating_stats import apply_rating_change, get_rating_stats
+from app.search import search_condition, search_rank, refresh_search_document
+from app.cache import catalog_cache, make_key, product_tags, MISSING
+from app.http_cache import RenderedBody, render, conditional_response, CACHE_CONTROL_PRODUCT, CACHE_CONTROL_DICTIONARY, CACHE_CONTROL_CATALOG_LIST, CACHE_CONTROL_NO_STORE
+from app.export import export_query, ndjson_chunks, csv_chunks
+from app.leaderboard import leaderboard, LEADERBOARD_SIZE
+from app.autocomplete import autocomplete_index
+from app.projection import parse_projection, projection_adapter, dump_product
+from app.comment_threads import load_subtrees, nest, MAX_THREAD_DEPTH
+from app.comment_votes import toggle_comment_vote
+from app.purchases import has_purchased, purchased_product_ids
+from fastapi.responses import StreamingResponse, Response
+from pydantic import TypeAdapter
+from typing import List, Optional, Union
+import json
 
 
 
 router = APIRouter(prefix="/products", tags=["Products"])
 
-@router.get("", response_model=List[ProductReadWithRating])
-async def list_products(
-    skip: int = 0,
-    limit: int = 30,
-    q: Optional[str] = Query(None, description="Поисковый запрос по названию"),
-    price_min: Optional[float] = Query(None, description="Минимальная цена"),
-    price_max: Optional[float] = Query(None, description="Максимальная цена"),
-    brand_id: Optional[int] = Query(None, description="ID бренда"),
-    music_type_id: Optional[int] = Query(None, description="ID типа музыкального инструмента"),
-    db: AsyncSession = Depends(get_db)
-):
-    avg_rating_subq = (
-        select(
-            Rating.product_id,
-            func.avg(Rating.value).label("avg_rating")
-        )
-        .group_by(Rating.product_id)
-        .subquery()
-    )
+music_type_list_adapter = TypeAdapter(List[MusicTypeRead])
+
+COMMENT_SORT_COLUMNS = {
+    "top": Comment.rating,
+    "newest": Comment.created_at,
+}
+
+PRODUCT_SORT_COLUMNS = {
+    "id": Product.id,
+    "price": Product.price,
+    "created_at": Product.created_at,
+    "title": Product.title,
+}
+
+
+# Границы ценовых диапазонов для фасетов (руб.)
+PRICE_BANDS = [0, 5000, 15000, 30000, 60000, 100000]
 
-    query = (
-        select(Product, avg_rating_subq.c.avg_rating)
-        .outerjoin(avg_rating_subq, Product.id == avg_rating_subq.c.product_id)
-        .options(selectinload(Product.images))
-        .options(selectinload(Product.brand))
-        .options(selectinload(Product.music_type))
-    )
 
+def apply_product_filters(query, q, price_min, price_max, brand_id, music_type_id):
     if q:
-        query = query.where(Product.title.ilike(f"%{q}%"))
+        query = query.where(search_condition(q))
 
     if price_min is not None:
         query = query.where(Product.price >= price_min)
@@ -55,61 +63,280 @@ async def list_products(
     if music_type_id is not None:
         query = query.where(Product.music_type_id == music_type_id)
 
-    query = query.offset(skip).limit(limit)
+    return query
 
-    result = await db.execute(query)
-    products_with_rating = result.all()
 
-    response = []
-    for product, avg_rating in products_with_rating:
-        product_data = ProductRead.model_validate(product, from_attributes=True).model_dump()
-        product_data['avg_rating'] = avg_rating or 0.0
-        response.append(ProductReadWithRating.model_validate(product_data))
+def normalize_search_query(q: Optional[str]) -> Optional[str]:
+    # Поиск нечувствителен к регистру и крайним пробелам, ключ кэша тоже
+    return " ".join(q.lower().split()) if q else None
 
-    return response
 
+def render_product(product: Product) -> RenderedBody:
+    return render(ProductRead.model_validate(product).model_dump_json().encode())
 
 
-@router.get("/top", response_model=List[ProductReadWithRating])
-async def get_high_rating_products(
-    min_rating: float = Query(4.0, ge=0, le=5),
+def products_with_rating_read(rows) -> list[dict]:
+    # Строки списка словарями прямо из загруженных колонок, см. dump_product
+    return [dump_product(product, avg_rating=avg_rating or 0.0) for product, avg_rating, *_ in rows]
+
+
+@router.get("", response_model=Union[List[ProductReadWithRating], ProductCursorPage])
+async def list_products(
+    request: Request,
     skip: int = 0,
-    limit: int = 20,
+    limit: int = 30,
+    sort: Optional[str] = Query(None, description="Поле сортировки: id, price, created_at, title, relevance; '-' в начале — по убыванию. По умолчанию relevance при поиске, иначе id"),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы; пустое значение — первая страница в режиме курсора"),
+    q: Optional[str] = Query(None, description="Поисковый запрос по названию, бренду, типу и описанию"),
+    price_min: Optional[float] = Query(None, description="Минимальная цена"),
+    price_max: Optional[float] = Query(None, description="Максимальная цена"),
+    brand_id: Optional[int] = Query(None, description="ID бренда"),
+    music_type_id: Optional[int] = Query(None, description="ID типа музыкального инструмента"),
+    fields: Optional[str] = Query(None, description="Поля товара через запятую, например id,title,price,image; без параметра — полный ответ"),
+    include: Optional[str] = Query(None, description="Связи для встраивания через запятую: images, brand, music_type"),
     db: AsyncSession = Depends(get_db)
 ):
-    avg_rating_subq = (
-        select(
-            Rating.product_id,
-            func.avg(Rating.value).label("avg_rating")
+    q = normalize_search_query(q)
+    projection = parse_projection(fields, include, extras=("avg_rating",))
+    if sort is None:
+        sort = "-relevance" if q else "id"
+    descending = sort.startswith("-")
+    sort_key = sort.lstrip("-")
+    if sort_key == "relevance" and q:
+        sort_column = search_rank(q)
+    else:
+        sort_column = PRODUCT_SORT_COLUMNS.get(sort_key)
+    if sort_column is None:
+        raise HTTPException(status_code=400, detail=f"Недопустимое поле сортировки: {sort_key}")
+
+    query = (
+        select(Product, ProductRatingStats.avg_rating, sort_column.label("sort_value"))
+        .outerjoin(ProductRatingStats, Product.id == ProductRatingStats.product_id)
+    )
+    if projection is None:
+        query = query.options(
+            selectinload(Product.images), selectinload(Product.brand), selectinload(Product.music_type)
         )
-        .group_by(Rating.product_id)
-        .subquery()
+    else:
+        query = query.options(*projection.options())
+
+    query = apply_product_filters(query, q, price_min, price_max, brand_id, music_type_id)
+
+    # Режим курсора: страница продолжается с ключа последней строки, без OFFSET
+    if cursor is not None:
+        after = decode_cursor(cursor, sort, sort_column) if cursor else None
+        query = apply_keyset(query, sort_column, Product.id, descending, after).limit(limit)
+    else:
+        query = apply_keyset(query, sort_column, Product.id, descending).offset(skip).limit(limit)
+
+    async def load(session: AsyncSession):
+        result = await session.execute(query)
+        products_with_rating = result.all()
+        if projection is None:
+            items = products_with_rating_read(products_with_rating)
+        else:
+            items = [
+                projection.dump(product, avg_rating=avg_rating or 0.0)
+                for product, avg_rating, _ in products_with_rating
+            ]
+        tags = ["catalog", *product_tags(*(product.id for product, *_ in products_with_rating))]
+
+        if cursor is None:
+            return render(projection_adapter.dump_json(items), tags=tags)
+
+        next_cursor = None
+        if len(products_with_rating) == limit:
+            last_product, _, last_value = products_with_rating[-1]
+            next_cursor = encode_cursor(sort, last_value, last_product.id)
+        return render(projection_adapter.dump_json({"data": items, "next_cursor": next_cursor}), tags=tags)
+
+    cache_key = make_key(
+        "products", skip=skip if cursor is None else None, limit=limit, sort=sort, cursor=cursor,
+        q=q, price_min=price_min, price_max=price_max,
+        brand_id=brand_id, music_type_id=music_type_id,
+        fields=projection.cache_key if projection else None,
     )
+    body = await catalog_cache.get_or_load(cache_key, load, db, tags=lambda body: body.tags)
+    return conditional_response(request, body, CACHE_CONTROL_CATALOG_LIST)
+
 
+
+@router.get("/facets", response_model=ProductFacetsResponse)
+async def get_product_facets(
+    q: Optional[str] = Query(None, description="Поисковый запрос по названию, бренду, типу и описанию"),
+    price_min: Optional[float] = Query(None, description="Минимальная цена"),
+    price_max: Optional[float] = Query(None, description="Максимальная цена"),
+    brand_id: Optional[int] = Query(None, description="ID бренда"),
+    music_type_id: Optional[int] = Query(None, description="ID типа музыкального инструмента"),
+    db: AsyncSession = Depends(get_db)
+):
+    q = normalize_search_query(q)
+    price_band = case(
+        *[(Product.price < bound, index) for index, bound in enumerate(PRICE_BANDS[1:])],
+        else_=len(PRICE_BANDS) - 1,
+    )
+    filtered = apply_product_filters(
+        select(
+            Brand.id.label("brand_id"),
+            Brand.name.label("brand_name"),
+            MusicType.id.label("music_type_id"),
+            MusicType.name.label("music_type_name"),
+            Category.id.label("category_id"),
+            Category.name.label("category_name"),
+            price_band.label("price_band"),
+        )
+        .select_from(Product)
+        .outerjoin(Brand, Brand.id == Product.brand_id)
+        .outerjoin(MusicType, MusicType.id == Product.music_type_id)
+        .outerjoin(Category, Category.id == MusicType.category_id),
+        q, price_min, price_max, brand_id, music_type_id,
+    ).subquery()
+
+    # Все фасеты считаются за один проход по отфильтрованным товарам через GROUPING SETS
+    c = filtered.c
     query = (
-        select(Product, avg_rating_subq.c.avg_rating)
-        .join(avg_rating_subq, Product.id == avg_rating_subq.c.product_id)
-        .where(avg_rating_subq.c.avg_rating >= min_rating)
-        .options(
-            selectinload(Product.images),
-            selectinload(Product.brand),
-            selectinload(Product.music_type)
+        select(
+            c.brand_id, c.brand_name, c.music_type_id, c.music_type_name,
+            c.category_id, c.category_name, c.price_band,
+            func.grouping(c.brand_id, c.brand_name).label("g_brand"),
+            func.grouping(c.music_type_id, c.music_type_name).label("g_music_type"),
+            func.grouping(c.category_id, c.category_name).label("g_category"),
+            func.count().label("count"),
+        ).group_by(
+            func.grouping_sets(
+                tuple_(c.brand_id, c.brand_name),
+                tuple_(c.music_type_id, c.music_type_name),
+                tuple_(c.category_id, c.category_name),
+                tuple_(c.price_band),
+            )
         )
-        .offset(skip)
-        .limit(limit)
     )
 
+    cache_key = make_key(
+        "facets", q=q, price_min=price_min,
+        price_max=price_max, brand_id=brand_id, music_type_id=music_type_id,
+    )
+    return await catalog_cache.get_or_load(
+        cache_key, lambda session: _load_facets(session, query), db,
+        tags=("catalog", "brands", "music_types", "categories"),
+    )
+
+
+async def _load_facets(db: AsyncSession, query) -> ProductFacetsResponse:
     result = await db.execute(query)
-    products_with_rating = result.all()
-
-    response = []
-    for product, avg_rating in products_with_rating:
-        
-        product_data = ProductRead.model_validate(product, from_attributes=True).model_dump()
-        
-        product_data['avg_rating'] = avg_rating or 0.0
-        
-        response.append(ProductReadWithRating.model_validate(product_data))
+    facets = {"brands": [], "music_types": [], "categories": [], "price_bands": []}
+    band_counts = {}
+    for row in result.all():
+        if row.g_brand == 0:
+            facets["brands"].append({"id": row.brand_id, "name": row.brand_name, "count": row.count})
+        elif row.g_music_type == 0:
+            facets["music_types"].append({"id": row.music_type_id, "name": row.music_type_name, "count": row.count})
+        elif row.g_category == 0:
+            facets["categories"].append({"id": row.category_id, "name": row.category_name, "count": row.count})
+        else:
+            band_counts[row.price_band] = row.count
+
+    for index, lower in enumerate(PRICE_BANDS):
+        upper = PRICE_BANDS[index + 1] if index + 1 < len(PRICE_BANDS) else None
+        facets["price_bands"].append({"min": lower, "max": upper, "count": band_counts.get(index, 0)})
+    for key in ("brands", "music_types", "categories"):
+        facets[key].sort(key=lambda bucket: bucket["count"], reverse=True)
+
+    return ProductFacetsResponse(total=sum(band_counts.values()), **facets)
+
+
+@router.post("/batch", response_model=ProductBatchResponse)
+async def get_products_batch(
+    batch: ProductBatchRequest,
+    fields: Optional[str] = Query(None, description="Поля товара через запятую, например id,title,price,image; без параметра — полный ответ"),
+    include: Optional[str] = Query(None, description="Связи для встраивания через запятую: images, brand, music_type"),
+    db: AsyncSession = Depends(get_db)
+):
+    # Повторы в запросе схлопываются, порядок первого упоминания сохраняется
+    ids = list(dict.fromkeys(batch.ids))
+    projection = parse_projection(fields, include)
+    bodies = {}
+    if projection is None:
+        for product_id in ids:
+            cached = catalog_cache.get(make_key("product", id=product_id))
+            if cached is not MISSING:
+                bodies[product_id] = cached.content
+
+    # Всё, чего нет в кэше, — одним запросом (плюс три selectinload), независимо от числа id
+    to_load = [product_id for product_id in ids if product_id not in bodies]
+    if to_load:
+        generation = catalog_cache.generation
+        query = select(Product).where(Product.id.in_(to_load))
+        if projection is None:
+            query = query.options(
+                selectinload(Product.images), selectinload(Product.brand), selectinload(Product.music_type)
+            )
+        else:
+            query = query.options(*projection.options())
+        result = await db.execute(query)
+        for product in result.scalars().all():
+            if projection is not None:
+                bodies[product.id] = projection_adapter.dump_json(projection.dump(product))
+                continue
+            body = render_product(product)
+            if not catalog_cache.invalidated_since(generation, product_tags(product.id)):
+                catalog_cache.set(make_key("product", id=product.id), body, tags=product_tags(product.id))
+            bodies[product.id] = body.content
+
+    missing = [product_id for product_id in ids if product_id not in bodies]
+    content = (
+        b'{"data":['
+        + b",".join(bodies[product_id] for product_id in ids if product_id in bodies)
+        + b'],"missing":'
+        + json.dumps(missing).encode()
+        + b"}"
+    )
+    return Response(content=content, media_type="application/json")
+
+
+@router.get("/autocomplete", response_model=List[AutocompleteSuggestion])
+async def autocomplete(
+    q: str = Query(..., min_length=1, description="Начало названия товара, бренда или типа"),
+    limit: int = Query(10, ge=1, le=10),
+):
+    # Только индекс в памяти, без обращения к БД
+    return autocomplete_index.suggest(q, limit)
+
+
+@router.get("/export")
+async def export_products(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$", description="Формат выгрузки: ndjson или csv"),
+    q: Optional[str] = Query(None, description="Поисковый запрос по названию, бренду, типу и описанию"),
+    price_min: Optional[float] = Query(None, description="Минимальная цена"),
+    price_max: Optional[float] = Query(None, description="Максимальная цена"),
+    brand_id: Optional[int] = Query(None, description="ID бренда"),
+    music_type_id: Optional[int] = Query(None, description="ID типа музыкального инструмента"),
+):
+    query = apply_product_filters(
+        export_query(), normalize_search_query(q), price_min, price_max, brand_id, music_type_id
+    )
+    if format == "csv":
+        return StreamingResponse(
+            csv_chunks(query),
+            media_type="text/csv; charset=utf-8",
+            headers={"Content-Disposition": 'attachment; filename="products.csv"'},
+        )
+    return StreamingResponse(ndjson_chunks(query), media_type="application/x-ndjson")
+
+
+@router.get("/top", response_model=List[LeaderboardEntry])
+async def get_high_rating_products(
+    request: Request,
+    min_rating: float = Query(4.0, ge=0, le=5),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=LEADERBOARD_SIZE),
+    db: AsyncSession = Depends(get_db)
+):
+    # Читаем из рейтинга в памяти; БД нужна только до первого пересчёта
+    if leaderboard.refreshed_at is None:
+        await leaderboard.refresh(db)
+    response = conditional_response(request, leaderboard.page(min_rating, skip, limit), CACHE_CONTROL_CATALOG_LIST)
+    response.headers["X-Leaderboard-Refreshed-At"] = leaderboard.refreshed_at.isoformat()
     return response
 
 
@@ -120,31 +347,56 @@ async def get_high_rating_products(
 
 
 
-@router.post("/{product_id}/comments", response_model=CommentRead, status_code=status.HTTP_201_CREATED)
+async def load_product_read(db: AsyncSession, product_id: int) -> ProductRead:
+    result = await db.execute(
+        select(Product)
+        .options(selectinload(Product.images), selectinload(Product.brand), selectinload(Product.music_type))
+        .where(Product.id == product_id)
+    )
+    product = result.scalars().first()
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return ProductRead.model_validate(product)
+
+
+async def load_comment(db: AsyncSession, comment_id: int, include: Optional[str] = None) -> dict:
+    # Компактный отзыв с автором одним запросом; товар — только по ?include=product
+    node = (await load_subtrees(db, [comment_id], max_depth=0))[0]
+    if include:
+        node["product"] = await load_product_read(db, node["product_id"])
+    return node
+
+
+@router.get("/review-eligibility", response_model=ReviewEligibility)
+async def get_review_eligibility(
+    ids: List[int] = Query(..., max_length=500, description="ID товаров: ?ids=1&ids=2"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    # Какие из товаров пользователь купил и может оценить и прокомментировать — один запрос
+    ids = list(dict.fromkeys(ids))
+    purchased = await purchased_product_ids(db, current_user.id, ids)
+    return ReviewEligibility(
+        eligible=[product_id for product_id in ids if product_id in purchased],
+        ineligible=[product_id for product_id in ids if product_id not in purchased],
+    )
+
+
+@router.post("/{product_id}/comments", response_model=CommentCompact, status_code=status.HTTP_201_CREATED)
 async def create_comment(
     product_id: int,
     comment: CommentCreate,
+    include: Optional[str] = Query(None, pattern="^product$", description="product — встроить в ответ товар"),
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
     # Проверяем, что товар существует
-    result = await db.execute(select(Product).where(Product.id == product_id))
-    product = result.scalars().first()
-    if not product:
+    result = await db.execute(select(Product.id).where(Product.id == product_id))
+    if result.scalar() is None:
         raise HTTPException(status_code=404, detail="Product not found")
 
     # Проверяем, что пользователь покупал этот товар
-    result = await db.execute(
-        select(OrderItem)
-        .join(Order)
-        .where(
-            Order.user_id == current_user.id,
-            Order.status == OrderStatusEnum.COMPLETED,
-            OrderItem.product_id == product_id
-        )
-    )
-    bought_item = result.scalars().first()
-    if not bought_item:
+    if not await has_purchased(db, current_user.id, product_id):
         raise HTTPException(
             status_code=403,
             detail="Оставлять отзыв могут только пользователи, купившие этот товар"
@@ -157,41 +409,21 @@ async def create_comment(
     )
     db.add(db_comment)
     await db.commit()
-    await db.refresh(db_comment)
 
-    # Подгружаем все нужные связи для корректной сериализации
-    result = await db.execute(
-        select(Comment)
-        .options(
-            selectinload(Comment.user),
-            selectinload(Comment.product).selectinload(Product.images),  # <-- вот это важно!
-            selectinload(Comment.parent),
-            selectinload(Comment.product).selectinload(Product.brand),
-            selectinload(Comment.product).selectinload(Product.music_type),
-        )
-        .where(Comment.id == db_comment.id)
-    )
-    comment_with_relations = result.scalars().first()
-    return comment_with_relations
+    return await load_comment(db, db_comment.id, include)
 
 
-@router.patch("/comments/{comment_id}", response_model=CommentRead)
+@router.patch("/comments/{comment_id}", response_model=CommentCompact)
 async def update_comment(
     comment_id: int,
     comment_update: CommentCreate,  # или отдельную схему, например, CommentUpdate
+    include: Optional[str] = Query(None, pattern="^product$", description="product — встроить в ответ товар"),
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
     # Найти комментарий
-    result = await db.execute(select(Comment)
-     .options(
-        selectinload(Comment.user),
-        selectinload(Comment.product).selectinload(Product.images),
-        selectinload(Comment.product).selectinload(Product.brand),
-        selectinload(Comment.product).selectinload(Product.music_type),
-        selectinload(Comment.parent)
-    )
-     .where(Comment.id == comment_id)
+    result = await db.execute(
+        select(Comment).options(noload(Comment.children)).where(Comment.id == comment_id)
     )
     comment = result.scalars().first()
     if not comment:
@@ -205,26 +437,27 @@ async def update_comment(
     comment.content = comment_update.content
     db.add(comment)
     await db.commit()
-    await db.refresh(comment)
-    return comment
+
+    return await load_comment(db, comment_id, include)
 
 
 
-@router.post("/{product_id}/comments/reply", response_model=CommentRead, status_code=status.HTTP_201_CREATED)
+@router.post("/{product_id}/comments/reply", response_model=CommentCompact, status_code=status.HTTP_201_CREATED)
 async def create_comment_reply(
     product_id: int,
     comment: CommentCreate,
+    include: Optional[str] = Query(None, pattern="^product$", description="product — встроить в ответ товар"),
     db: AsyncSession = Depends(get_db)
 ):
     # Проверяем существование товара
-    product = await db.get(Product, product_id)
-    if not product:
+    result = await db.execute(select(Product.id).where(Product.id == product_id))
+    if result.scalar() is None:
         raise HTTPException(status_code=404, detail="Product not found")
 
     # Проверяем существование родительского комментария
     if comment.parent_id:
-        parent_comment = await db.get(Comment, comment.parent_id)
-        if not parent_comment:
+        result = await db.execute(select(Comment.id).where(Comment.id == comment.parent_id))
+        if result.scalar() is None:
             raise HTTPException(status_code=404, detail="Parent comment not found")
 
     # Создаем комментарий
@@ -237,156 +470,109 @@ async def create_comment_reply(
     
     db.add(db_comment)
     await db.commit()
-    await db.refresh(db_comment)
-    
-    # Загружаем связи для ответа
-    result = await db.execute(
-        select(Comment)
-        .options(
-            selectinload(Comment.user),
-            selectinload(Comment.product).selectinload(Product.images),
-            selectinload(Comment.children),
-            selectinload(Comment.product).selectinload(Product.brand),
-            selectinload(Comment.product).selectinload(Product.music_type),
-        )
-        .where(Comment.id == db_comment.id)
-    )
-    
-    comment_with_relations = result.scalar_one()
-    return comment_with_relations
-
-@router.get("/{product_id}/comments", response_model=List[CommentRead])
-async def get_product_comments(product_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(Comment)
-        .options(
-            selectinload(Comment.user),
-            selectinload(Comment.product).selectinload(Product.images),
-            selectinload(Comment.product).selectinload(Product.brand),
-            selectinload(Comment.product).selectinload(Product.music_type),
-            selectinload(Comment.parent).selectinload(Comment.user),
-            selectinload(Comment.children).selectinload(Comment.user),
-        )
-        .where(Comment.product_id == product_id)
-    )
-    comments = result.scalars().all()
-
-    # Получаем id всех комментариев
-    comment_ids = [c.id for c in comments]
-    # Получаем рейтинги всех комментариев одним запросом
-    ratings_result = await db.execute(
-        select(CommentRating.comment_id, func.coalesce(func.sum(CommentRating.value), 0))
-        .where(CommentRating.comment_id.in_(comment_ids))
-        .group_by(CommentRating.comment_id)
-    )
-    ratings_map = dict(ratings_result.all())
-
-    # Вставляем рейтинг в каждый комментарий
-    for c in comments:
-        setattr(c, 'rating', ratings_map.get(c.id, 0))
 
-    comments.sort(key=lambda c: c.rating, reverse=True)
+    return await load_comment(db, db_comment.id, include)
 
-    return comments
-
-    
+@router.get("/{product_id}/comments", response_model=Union[List[CommentCompact], CommentCursorPage])
+async def get_product_comments(
+    product_id: int,
+    sort: str = Query("top", pattern="^(top|newest)$", description="Порядок корневых отзывов: top — по рейтингу, newest — сначала новые"),
+    skip: int = 0,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="Курсор следующей страницы; пустое значение — первая страница в режиме курсора"),
+    include: Optional[str] = Query(None, pattern="^product$", description="product — встроить в ответ товар"),
+    db: AsyncSession = Depends(get_db)
+):
+    # Товар один на всю страницу и только по запросу
+    product = None
+    if include:
+        product = await load_product_read(db, product_id)
 
-    # Получаем id всех комментариев
-    comment_ids = [c.id for c in comments]
-    # Получаем рейтинги всех комментариев одним запросом
-    ratings_result = await db.execute(
-        select(CommentRating.comment_id, func.coalesce(func.sum(CommentRating.value), 0))
-        .where(CommentRating.comment_id.in_(comment_ids))
-        .group_by(CommentRating.comment_id)
+    # Страница — это корневые отзывы; ответы на них идут в том же плоском списке следом
+    sort_column = COMMENT_SORT_COLUMNS[sort]
+    query = (
+        select(Comment.id, sort_column.label("sort_value"))
+        .where(Comment.product_id == product_id, Comment.parent_id.is_(None))
     )
-    ratings_map = dict(ratings_result.all())
-
-    # Вставляем рейтинг в каждый комментарий
-    for c in comments:
-        setattr(c, 'rating', ratings_map.get(c.id, 0))
-
-    comments.sort(key=lambda c: c.rating, reverse=True)
-
-    return comments
-
-
+    if cursor is not None:
+        after = decode_cursor(cursor, sort, sort_column) if cursor else None
+        query = apply_keyset(query, sort_column, Comment.id, True, after).limit(limit)
+    else:
+        query = apply_keyset(query, sort_column, Comment.id, True).offset(skip).limit(limit)
 
+    result = await db.execute(query)
+    page = result.all()
+    root_ids = [row.id for row in page]
+
+    # Корни страницы вместе со всеми ответами — один рекурсивный запрос
+    nodes = await load_subtrees(db, root_ids)
+    position = {root_id: index for index, root_id in enumerate(root_ids)}
+    roots = sorted((node for node in nodes if node["depth"] == 0), key=lambda node: position[node["id"]])
+    comments = roots + [node for node in nodes if node["depth"] > 0]
+    if product is not None:
+        for comment in comments:
+            comment["product"] = product
+
+    if cursor is None:
+        return comments
+    next_cursor = None
+    if len(page) == limit:
+        next_cursor = encode_cursor(sort, page[-1].sort_value, page[-1].id)
+    total = None
+    if not cursor:
+        result = await db.execute(
+            select(func.count()).where(Comment.product_id == product_id, Comment.parent_id.is_(None))
+        )
+        total = result.scalar()
+    return CommentCursorPage(data=comments, next_cursor=next_cursor, total=total)
 
 
+@router.get("/comments/{comment_id}/thread", response_model=CommentCompact)
+async def get_comment_thread(
+    comment_id: int,
+    depth: Optional[int] = Query(None, ge=0, le=MAX_THREAD_DEPTH, description="Сколько уровней ответов загрузить; по умолчанию вся ветка"),
+    db: AsyncSession = Depends(get_db)
+):
+    # Ветка целиком одним запросом, вложенность собирается в памяти
+    nodes = await load_subtrees(db, [comment_id], depth)
+    if not nodes:
+        raise HTTPException(status_code=404, detail="Комментарий не найден")
+    return nest(nodes)[0]
 
 
 @router.post("/comments/{comment_id}/rating", response_model=Optional[CommentRatingRead])
 async def create_or_toggle_comment_rating(
     comment_id: int,
     rating: CommentRatingCreate,
+    response: Response,
     current_user: User = Depends(get_current_user),  # <--- вот это важно!
     db: AsyncSession = Depends(get_db)
 ):
-    # Проверяем, что комментарий существует
-    result = await db.execute(select(Comment).where(Comment.id == comment_id))
-    comment = result.scalars().first()
-    if not comment:
+    # Повторный клик на тот же голос снимает его, другой голос заменяет прежний;
+    # рейтинг отзыва сдвигается на разницу тем же оператором
+    try:
+        vote_id, total = await toggle_comment_vote(db, comment_id, current_user.id, rating.value)
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Комментарий не найден")
+    if total is None:
+        await db.rollback()
         raise HTTPException(status_code=404, detail="Комментарий не найден")
-
-    # Проверяем, есть ли уже рейтинг от этого пользователя
-    result = await db.execute(
-        select(CommentRating).where(
-            CommentRating.user_id == current_user.id,
-            CommentRating.comment_id == comment_id
-        )
-    )
-    existing_rating = result.scalars().first()
-
-    # Логика обработки рейтинга
-    if existing_rating:
-        if existing_rating.value == rating.value:
-            # Повторный клик на тот же рейтинг - удаляем (отмена)
-            await db.delete(existing_rating)
-            await db.commit()
-            updated_rating = None
-        else:
-            # Меняем рейтинг
-            existing_rating.value = rating.value
-            db.add(existing_rating)
-            await db.commit()
-            await db.refresh(existing_rating)
-            updated_rating = existing_rating
-    else:
-        # Создаём новый рейтинг
-        db_rating = CommentRating(
-            user_id=current_user.id,  # <--- используем id авторизованного пользователя
-            comment_id=comment_id,
-            value=rating.value
-        )
-        db.add(db_rating)
-        await db.commit()
-        await db.refresh(db_rating)
-        updated_rating = db_rating
-
-    # Пересчитываем общий рейтинг комментария
-    result = await db.execute(
-        select(func.coalesce(func.sum(CommentRating.value), 0))
-        .where(CommentRating.comment_id == comment_id)
-    )
-    total_rating = result.scalar_one()
-
-    comment.rating = total_rating
-    db.add(comment)
     await db.commit()
 
-    return updated_rating
+    response.headers["X-Comment-Rating-Total"] = str(total)
+    if vote_id is None:
+        return None
+    return CommentRatingRead(
+        id=vote_id, user_id=current_user.id, comment_id=comment_id, value=rating.value, total=total
+    )
 
 
 
 @router.get("/comments/{comment_id}/rating")
 async def get_comment_rating(comment_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(
-            func.coalesce(func.sum(CommentRating.value), 0).label("total"),
-        ).where(CommentRating.comment_id == comment_id)
-    )
-    row = result.first()
-    return {"total": row.total}
+    result = await db.execute(select(Comment.rating).where(Comment.id == comment_id))
+    return {"total": result.scalar() or 0}
 
 
 @router.post("/{product_id}/rating", response_model=RatingRead, status_code=status.HTTP_201_CREATED)
@@ -402,34 +588,28 @@ async def create_rating(
         raise HTTPException(status_code=404, detail="Product not found")
 
     # Проверяем покупку товара
-    order_item = await db.execute(
-        select(OrderItem)
-        .join(Order)
-        .where(
-            Order.user_id == current_user.id,
-            Order.status == OrderStatusEnum.COMPLETED,
-            OrderItem.product_id == product_id
-        )
-    )
-    if not order_item.scalars().first():
+    if not await has_purchased(db, current_user.id, product_id):
         raise HTTPException(
             status_code=403,
             detail="Оценивать товар могут только пользователи, купившие его"
         )
 
-    # Проверяем существующий рейтинг
+    # Проверяем существующий рейтинг (блокируем строку, чтобы дельта к агрегатам была точной)
     existing_rating = await db.execute(
         select(Rating)
         .where(
             Rating.product_id == product_id,
             Rating.user_id == current_user.id
         )
+        .with_for_update()
     )
     existing_rating = existing_rating.scalars().first()
 
     if existing_rating:
+        old_value = existing_rating.value
         existing_rating.value = rating.value
     else:
+        old_value = None
         existing_rating = Rating(
             product_id=product_id,
             user_id=current_user.id,
@@ -437,7 +617,13 @@ async def create_rating(
         )
         db.add(existing_rating)
 
+    await db.flush()
+    if old_value != rating.value:
+        await apply_rating_change(db, product_id, old_value, rating.value)
     await db.commit()
+    if old_value != rating.value:
+        catalog_cache.invalidate(*product_tags(product_id))
+        leaderboard.mark_dirty()
     await db.refresh(existing_rating)
 
     # Явная загрузка связей
@@ -459,17 +645,28 @@ async def create_rating(
 
 @router.get("/{product_id}/rating")
 async def get_product_rating(product_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(func.avg(Rating.value)).where(Rating.product_id == product_id)
-    )
-    avg_rating = result.scalar()
-    return {"average": avg_rating or 0}
+    return await get_rating_stats(db, product_id)
+
+@router.get("/{product_id}/availability", response_model=ProductAvailability)
+async def get_product_availability(product_id: int, response: Response, db: AsyncSession = Depends(get_db)):
+    # Свободный остаток отдельно от карточки товара и без кэша: он меняется с каждым резервом
+    # корзины, а закэшированная карточка сбрасывается только при изменении самого товара
+    result = await db.execute(select(Product.available).where(Product.id == product_id))
+    available = result.scalar()
+    if available is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    response.headers["Cache-Control"] = CACHE_CONTROL_NO_STORE
+    return {"product_id": product_id, "available": available}
 
 @router.post("/", response_model=ProductRead)
 async def create_product(product: ProductCreate, db: AsyncSession = Depends(get_db)):
     db_product = Product(**product.dict())
     db.add(db_product)
+    await db.flush()
+    await refresh_search_document(db, db_product.id)
     await db.commit()
+    catalog_cache.invalidate("catalog")
+    autocomplete_index.add("product", db_product.id, db_product.title)
     await db.refresh(db_product)
     return db_product
 
@@ -480,21 +677,45 @@ async def create_product(product: ProductCreate, db: AsyncSession = Depends(get_
 
 
 @router.get("/music_types", response_model=List[MusicTypeRead])
-async def list_music_types(db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(MusicType))
-    music_types = result.scalars().all()
-    return music_types
+async def list_music_types(request: Request, db: AsyncSession = Depends(get_db)):
+    async def load(session: AsyncSession):
+        result = await session.execute(select(MusicType))
+        music_types = result.scalars().all()
+        return render(music_type_list_adapter.dump_json(music_types))
+
+    body = await catalog_cache.get_or_load(make_key("music_types"), load, db, tags=("music_types",))
+    return conditional_response(request, body, CACHE_CONTROL_DICTIONARY)
 
 
 @router.get("/{product_id}", response_model=ProductRead)
-async def get_product(product_id: int, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(
-        select(Product)
-        .options(selectinload(Product.images), selectinload(Product.brand), selectinload(Product.music_type))
-        .where(Product.id == product_id)
+async def get_product(
+    product_id: int,
+    request: Request,
+    fields: Optional[str] = Query(None, description="Поля товара через запятую, например id,title,price,image; без параметра — полный ответ"),
+    include: Optional[str] = Query(None, description="Связи для встраивания через запятую: images, brand, music_type"),
+    db: AsyncSession = Depends(get_db)
+):
+    projection = parse_projection(fields, include)
+
+    async def load(session: AsyncSession):
+        query = select(Product).where(Product.id == product_id)
+        if projection is None:
+            query = query.options(
+                selectinload(Product.images), selectinload(Product.brand), selectinload(Product.music_type)
+            )
+        else:
+            query = query.options(*projection.options())
+        result = await session.execute(query)
+        product = result.scalars().first()
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        if projection is not None:
+            return render(projection_adapter.dump_json(projection.dump(product)))
+        return render_product(product)
+
+    body = await catalog_cache.get_or_load(
+        make_key("product", id=product_id, fields=projection.cache_key if projection else None),
+        load, db, tags=product_tags(product_id)
     )
-    product = result.scalars().first()
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    return product
+    return conditional_response(request, body, CACHE_CONTROL_PRODUCT)
 
@@ -6,6 +6,7 @@ from app.database import get_db
 from app.models import Supply, SupplyItem, User, Supplier, Product
 from app.schemas import SupplyCreate, SupplyRead, SupplyItemCreate
 from app.auth.dependencies import get_current_user
+from app.cache import catalog_cache, product_tags
 from typing import List, Optional
 
 
@@ -51,5 +52,6 @@ async def create_supply(
         db.add(product)  # помечаем объект как измененный
 
     await db.commit()
+    catalog_cache.invalidate(*product_tags(*(item.product_id for item in supply.items)))
     await db.refresh(new_supply)
     return new_supply
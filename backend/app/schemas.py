@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field, field_validator
 from datetime import datetime
-from typing import Optional 
+from typing import Optional, Literal, Union, Annotated
 
 
 
@@ -177,6 +177,11 @@ class ProductRead(ProductCreate):
     class Config:
         from_attributes = True
 
+class ProductAvailability(BaseModel):
+    product_id: int
+    # Остаток за вычетом резервов корзин
+    available: int
+
 class ProductListResponse(BaseModel):
     data: list[ProductRead]
     total: int
@@ -189,6 +194,43 @@ class ProductReadWithRating(ProductRead):
         "from_attributes": True
     }
 
+class ProductBatchRequest(BaseModel):
+    ids: list[int] = Field(min_length=1, max_length=500)
+
+class ProductBatchResponse(BaseModel):
+    data: list[ProductRead]
+    missing: list[int]
+
+class AutocompleteSuggestion(BaseModel):
+    kind: str
+    id: int
+    label: str
+
+class LeaderboardEntry(ProductReadWithRating):
+    rating_count: int
+    score: float
+
+class ProductCursorPage(BaseModel):
+    data: list[ProductReadWithRating]
+    next_cursor: Optional[str] = None
+
+class FacetBucket(BaseModel):
+    id: Optional[int] = None
+    name: Optional[str] = None
+    count: int
+
+class PriceBandBucket(BaseModel):
+    min: float
+    max: Optional[float] = None
+    count: int
+
+class ProductFacetsResponse(BaseModel):
+    total: int
+    brands: list[FacetBucket]
+    music_types: list[FacetBucket]
+    categories: list[FacetBucket]
+    price_bands: list[PriceBandBucket]
+
 
 # ---------------------------
 
@@ -227,6 +269,35 @@ class CommentRead(BaseModel):
 # Обязательно добавь для рекурсивных ссылок
 CommentRead.update_forward_refs()
 
+class ReviewEligibility(BaseModel):
+    # Товары, которые пользователь купил (можно оставить отзыв и оценку), и остальные
+    eligible: list[int]
+    ineligible: list[int]
+
+class CommentAuthor(BaseModel):
+    id: int
+    name: str
+    avatar_url: Optional[str] = None
+
+class CommentCompact(BaseModel):
+    # Отзыв без встроенного товара: товар добавляется только по ?include=product
+    id: int
+    user_id: int
+    product_id: int
+    content: str
+    rating: int = 0
+    parent_id: Optional[int] = None
+    created_at: Optional[datetime] = None
+    user: Optional[CommentAuthor] = None
+    children: list["CommentCompact"] = []
+    product: Optional[ProductRead] = None
+
+class CommentCursorPage(BaseModel):
+    data: list[CommentCompact]
+    next_cursor: Optional[str] = None
+    # Число корневых отзывов товара; считается только для первой страницы
+    total: Optional[int] = None
+
 class CommentListResponse(BaseModel):
     data: list[CommentRead]
     total: int
@@ -244,6 +315,8 @@ class CommentRatingRead(CommentRatingCreate):
     user_id: int
     comment_id: int
     value: int
+    # Рейтинг отзыва после этого голоса
+    total: Optional[int] = None
 
 
     class Config:
@@ -266,6 +339,7 @@ class OrderItemRead(BaseModel):
     order_id: int
     product_id: int
     quantity: int
+    unit_price: Optional[float] = None
     product: ProductRead
     
     
@@ -273,6 +347,42 @@ class OrderItemRead(BaseModel):
     class Config:
         from_attributes = True
 
+class CartLineRead(BaseModel):
+    # Позиция корзины без графа товара; товар — только по ?include=product
+    id: int
+    order_id: int
+    product_id: int
+    quantity: int
+    product: Optional[ProductRead] = None
+
+    class Config:
+        from_attributes = True
+
+class CartSetQuantity(BaseModel):
+    op: Literal["set"]
+    item_id: int
+    quantity: int = Field(gt=0)
+
+class CartRemove(BaseModel):
+    op: Literal["remove"]
+    item_id: int
+
+class CartAdd(BaseModel):
+    op: Literal["add"]
+    product_id: int
+    quantity: int = Field(gt=0)
+
+CartOperation = Annotated[Union[CartSetQuantity, CartRemove, CartAdd], Field(discriminator="op")]
+
+class CartBulkRequest(BaseModel):
+    operations: list[CartOperation] = Field(min_length=1, max_length=200)
+
+class CartSummary(BaseModel):
+    order_id: int
+    items: list[CartLineRead]
+    items_count: int
+    total_amount: float
+
 class OrderRead(BaseModel):
     id: int
     user_id: int
@@ -291,6 +401,35 @@ OrderRead.update_forward_refs()
 OrderItemRead.update_forward_refs()
 OrderItemUpdate.update_forward_refs()
 
+class OrderSummary(BaseModel):
+    # Заказ в истории без позиций; итоги сохранены при оформлении
+    id: int
+    created_at: datetime
+    status: str
+    barcode: Optional[str] = None
+    total_amount: Optional[float] = None
+    items_count: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+class OrderHistoryPage(BaseModel):
+    data: list[OrderSummary]
+    next_cursor: Optional[str] = None
+
+class OrderLineProduct(BaseModel):
+    id: int
+    title: str
+    image: Optional[str] = None
+
+class OrderLineRead(BaseModel):
+    # Позиция оформленного заказа с ценой на момент покупки
+    id: int
+    product_id: int
+    quantity: int
+    unit_price: Optional[float] = None
+    product: OrderLineProduct
+
 class OrderListResponse(BaseModel):
     data: list[OrderRead]
     total: int
@@ -315,7 +454,7 @@ class FavoriteRead(FavoriteCreate):
 # --- Рейтинги ---
 
 class RatingCreate(BaseModel):
-    value: int
+    value: int = Field(ge=1, le=5)
 
 class RatingRead(RatingCreate):
     id: int
@@ -0,0 +1,74 @@
+from sqlalchemy import Float, Text, case, exists, func, literal, or_, select, update, literal_column
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+from app.models import Product, Brand, MusicType
+
+# Конфигурация полнотекстового поиска: латиница стеммится как english, кириллица как russian
+SEARCH_CONFIG = "russian"
+
+
+def _weighted(text_expr, weight: str):
+    return func.setweight(func.to_tsvector(SEARCH_CONFIG, func.coalesce(text_expr, "")), literal_column(f"'{weight}'"))
+
+
+def search_document(brand_name, music_type_name):
+    # Документ товара: название (A) важнее бренда и типа (B), описание (C)
+    return (
+        _weighted(Product.title, "A")
+        .op("||")(_weighted(brand_name, "B"))
+        .op("||")(_weighted(music_type_name, "B"))
+        .op("||")(_weighted(Product.description, "C"))
+    )
+
+
+def _ts_query(q: str):
+    return func.websearch_to_tsquery(SEARCH_CONFIG, q)
+
+
+def _document_match(q: str, product=Product):
+    return product.search_vector.op("@@")(_ts_query(q))
+
+
+def _typo_pattern(q: str):
+    # Запрос для триграммного сходства, только если ни документ, ни подстрока названия не совпали
+    # ни у одного товара, иначе NULL: с ним индексное условие title % NULL ничего не читает.
+    # Две отдельные проверки: с OR планировщик проверяет существование последовательным чтением
+    by_document, by_title = aliased(Product), aliased(Product)
+    return (
+        select(literal(q, Text))
+        .where(
+            ~exists().where(_document_match(q, by_document)),
+            ~exists().where(by_title.title.ilike(f"%{q}%")),
+        )
+        .scalar_subquery()
+    )
+
+
+def search_condition(q: str):
+    # Совпадение по индексу tsvector или подстрока названия; триграммы по названию — запасной
+    # вариант для опечаток. Всегда включённые, они добавляли к ранжированию все похожие названия
+    return or_(
+        _document_match(q),
+        Product.title.ilike(f"%{q}%"),
+        Product.title.op("%")(_typo_pattern(q)),
+    )
+
+
+def search_rank(q: str):
+    # ts_rank_cd — для совпавших документов, сходство названия — для подстрок и опечаток
+    return case(
+        (_document_match(q), func.ts_rank_cd(Product.search_vector, _ts_query(q), type_=Float)),
+        else_=func.similarity(Product.title, q, type_=Float),
+    )
+
+
+async def refresh_search_document(db: AsyncSession, product_id: int) -> None:
+    # Пересобирает документ товара; вызывается в той же транзакции, что и изменение товара
+    brand_name = select(Brand.name).where(Brand.id == Product.brand_id).scalar_subquery()
+    music_type_name = select(MusicType.name).where(MusicType.id == Product.music_type_id).scalar_subquery()
+    await db.execute(
+        update(Product)
+        .where(Product.id == product_id)
+        .values(search_vector=search_document(brand_name, music_type_name))
+        .execution_options(synchronize_session=False)
+    )
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+from datetime import timedelta
+from sqlalchemy import select, update, delete, case, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import async_session_maker
+from app.models import Product, StockReservation
+
+logger = logging.getLogger(__name__)
+
+# Сколько корзина удерживает товар после последнего добавления или изменения количества
+RESERVATION_TTL = timedelta(minutes=15)
+SWEEP_INTERVAL = 30.0
+
+
+def _locked_products(product_ids):
+    # Строки товаров блокируются в порядке id, и всегда раньше строк резервов,
+    # поэтому списание, резервирование и чистка не взаимоблокируются
+    return select(Product.id).where(Product.id.in_(list(product_ids))).order_by(Product.id).with_for_update()
+
+
+async def deduct_stock(db: AsyncSession, demand: dict[int, int]) -> dict[int, float]:
+    # Одним UPDATE списывает остатки только там, где хватает свободного (не зарезервированного другими
+    # корзинами) количества, и возвращает цены списанных товаров (под той же блокировкой, так что это
+    # и есть цена покупки). Резерв самой корзины снимается до вызова, см. release_reservations.
+    # Условие на остаток перепроверяется после ожидания блокировки — перепродажи нет.
+    # При неполном списании вызывающий код откатывает транзакцию
+    if not demand:
+        return {}
+    wanted = case(demand, value=Product.id)
+    result = await db.execute(
+        update(Product)
+        .where(Product.id.in_(_locked_products(demand)), Product.quantity - Product.reserved_quantity >= wanted)
+        .values(quantity=Product.quantity - wanted)
+        .returning(Product.id, Product.price)
+        .execution_options(synchronize_session=False)
+    )
+    return dict(result.all())
+
+
+async def lock_products(db: AsyncSession, product_ids) -> dict[int, int]:
+    # Блокирует строки товаров и возвращает их свободный остаток. Вызывается до вставки позиций
+    # корзины: вставка берёт на товар KEY SHARE, и повышение до FOR UPDATE после неё
+    # взаимоблокирует параллельные добавления одного товара
+    result = await db.execute(
+        select(Product.id, Product.quantity - Product.reserved_quantity)
+        .where(Product.id.in_(list(product_ids)))
+        .order_by(Product.id)
+        .with_for_update()
+    )
+    return dict(result.all())
+
+
+async def sync_reservations(
+    db: AsyncSession,
+    order_id: int,
+    free: dict[int, int],
+    targets: dict[int, int],
+    required: dict[int, int],
+) -> list[int]:
+    # Подводит резерв корзины по товарам к targets (обычно — новое количество в позиции).
+    # free — результат lock_products для тех же товаров. Уменьшение всегда проходит; увеличение
+    # берётся из свободного остатка сверх уже существующего резерва, и отказом считается только
+    # нехватка на required (прирост самой позиции). Недостающее сверх required — по возможности:
+    # резерв мог истечь или корзина создана до резервов.
+    # Возвращает товары с нехваткой — вызывающий код откатывает транзакцию.
+    # Кэш товаров не сбрасывается: свободный остаток в закэшированные ответы не входит
+    failed = [product_id for product_id in targets if free.get(product_id, 0) < required.get(product_id, 0)]
+    if failed:
+        return failed
+
+    result = await db.execute(
+        select(StockReservation.product_id, StockReservation.quantity)
+        .where(StockReservation.order_id == order_id, StockReservation.product_id.in_(list(targets)))
+        .with_for_update()
+    )
+    held = dict(result.all())
+    delta = {}
+    for product_id, target in targets.items():
+        current = held.get(product_id, 0)
+        if target <= current:
+            delta[product_id] = target - current
+        else:
+            delta[product_id] = min(target - current, max(free[product_id], 0))
+
+    changed = {product_id: value for product_id, value in delta.items() if value}
+    if changed:
+        await db.execute(
+            update(Product)
+            .where(Product.id.in_(list(changed)))
+            .values(reserved_quantity=Product.reserved_quantity + case(changed, value=Product.id))
+            .execution_options(synchronize_session=False)
+        )
+
+    kept = {product_id: held.get(product_id, 0) + delta[product_id] for product_id in targets}
+    dropped = [product_id for product_id, quantity in kept.items() if quantity <= 0 and product_id in held]
+    if dropped:
+        await db.execute(
+            delete(StockReservation)
+            .where(StockReservation.order_id == order_id, StockReservation.product_id.in_(dropped))
+            .execution_options(synchronize_session=False)
+        )
+    # Оставшиеся резервы продлеваются одним многострочным upsert
+    rows = [
+        {
+            "order_id": order_id,
+            "product_id": product_id,
+            "quantity": quantity,
+            "expires_at": func.now() + RESERVATION_TTL,
+        }
+        for product_id, quantity in sorted(kept.items())
+        if quantity > 0
+    ]
+    if rows:
+        stmt = pg_insert(StockReservation).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[StockReservation.order_id, StockReservation.product_id],
+            set_={"quantity": stmt.excluded.quantity, "expires_at": stmt.excluded.expires_at},
+        )
+        await db.execute(stmt)
+    return []
+
+
+async def release_reservations(db: AsyncSession, order_id: int, product_ids) -> None:
+    # Снимает резервы корзины по товарам и уменьшает счётчики
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+    await lock_products(db, product_ids)
+    released = (
+        delete(StockReservation)
+        .where(StockReservation.order_id == order_id, StockReservation.product_id.in_(list(product_ids)))
+        .returning(StockReservation.product_id, StockReservation.quantity)
+        .cte("released")
+    )
+    await db.execute(
+        update(Product)
+        .where(Product.id == released.c.product_id)
+        .values(reserved_quantity=Product.reserved_quantity - released.c.quantity)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def sweep_expired_reservations(db: AsyncSession) -> None:
+    # Снимает все просроченные резервы
+    result = await db.execute(
+        select(Product.id)
+        .where(Product.id.in_(select(StockReservation.product_id).where(StockReservation.expires_at <= func.now())))
+        .order_by(Product.id)
+        .with_for_update()
+    )
+    product_ids = list(result.scalars().all())
+    if not product_ids:
+        await db.rollback()
+        return
+    released = (
+        delete(StockReservation)
+        .where(StockReservation.expires_at <= func.now(), StockReservation.product_id.in_(product_ids))
+        .returning(StockReservation.product_id, StockReservation.quantity)
+        .cte("released")
+    )
+    totals = (
+        select(released.c.product_id, func.sum(released.c.quantity).label("quantity"))
+        .group_by(released.c.product_id)
+        .subquery("totals")
+    )
+    await db.execute(
+        update(Product)
+        .where(Product.id == totals.c.product_id)
+        .values(reserved_quantity=Product.reserved_quantity - totals.c.quantity)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+
+async def run_sweeper() -> None:
+    # Фоновая задача: просроченные резервы возвращаются в свободный остаток
+    while True:
+        try:
+            async with async_session_maker() as session:
+                await sweep_expired_reservations(session)
+        except Exception:
+            logger.exception("Не удалось снять просроченные резервы")
+        await asyncio.sleep(SWEEP_INTERVAL)
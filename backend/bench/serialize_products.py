@@ -0,0 +1,75 @@
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from typing import List
+from pydantic import TypeAdapter
+from app.models import Product, ProductImage, Brand, MusicType
+from app.schemas import ProductRead, ProductReadWithRating
+from app.routers.product import products_with_rating_read
+from app.projection import projection_adapter
+
+# Сериализация страницы каталога (30 товаров) до и после user-007, без базы:
+#   python bench/serialize_products.py
+PAGE_SIZE = 30
+NUMBER = 200
+REPEAT = 5
+
+response_adapter = TypeAdapter(List[ProductReadWithRating])
+
+
+def make_rows():
+    # Строки как из запроса каталога: (товар со связями, средняя оценка, значение сортировки)
+    brand = Brand(id=1, name="Yamaha")
+    music_type = MusicType(id=1, name="Гитары", category_id=1)
+    rows = []
+    for i in range(1, PAGE_SIZE + 1):
+        product = Product(
+            id=i,
+            title=f"Товар {i}",
+            description="Описание товара " * 10,
+            price=1000.0 + i,
+            image=f"/static/uploads/{i}.jpg",
+            quantity=i,
+            brand_id=brand.id,
+            music_type_id=music_type.id,
+            brand=brand,
+            music_type=music_type,
+            images=[ProductImage(id=i * 10 + n, image_path=f"/static/uploads/{i}-{n}.jpg") for n in range(3)],
+        )
+        rows.append((product, 4.5 if i % 3 else None, i))
+    return rows
+
+
+def old_page(rows) -> bytes:
+    # Как было: три валидации на строку, затем проход FastAPI по response_model и json.dumps в JSONResponse
+    response = []
+    for product, avg_rating, _ in rows:
+        product_data = ProductRead.model_validate(product, from_attributes=True).model_dump()
+        product_data["avg_rating"] = avg_rating or 0.0
+        response.append(ProductReadWithRating.model_validate(product_data))
+    content = response_adapter.dump_python(response_adapter.validate_python(response), mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def new_page(rows) -> bytes:
+    # Как сейчас: словари из загруженных колонок без валидации и dump_json страницы целиком
+    return projection_adapter.dump_json(products_with_rating_read(rows))
+
+
+def main() -> None:
+    rows = make_rows()
+    assert json.loads(old_page(rows)) == json.loads(new_page(rows))
+    results = {}
+    for name, page in (("old", old_page), ("new", new_page)):
+        best = min(timeit.repeat(lambda: page(rows), number=NUMBER, repeat=REPEAT)) / NUMBER
+        results[name] = best
+        print(f"{name}: {best * 1e6:8.1f} мкс на страницу из {PAGE_SIZE} товаров")
+    print(f"ускорение: {results['old'] / results['new']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
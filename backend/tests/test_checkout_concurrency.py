@@ -0,0 +1,130 @@
+import asyncio
+from datetime import timedelta
+from uuid import uuid4
+import httpx
+from fastapi import Header, Depends
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from app.main import app
+from app.database import get_db
+from app.auth.dependencies import get_current_user
+from app.models import User, Product, Order, OrderItem, OrderStatusEnum, StockReservation
+from app.stock import sweep_expired_reservations
+
+STOCK = 60
+BUYERS = 200
+SWEEPS = 10
+CONCURRENCY = 20
+
+
+def test_parallel_checkouts_never_oversell(database_url):
+    asyncio.run(_parallel_checkouts(database_url))
+
+
+async def _parallel_checkouts(database_url: str) -> None:
+    engine = create_async_engine(database_url, pool_size=CONCURRENCY, max_overflow=0, pool_timeout=120)
+    sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+    tag = uuid4().hex[:8]
+
+    async def test_db():
+        async with sessions() as session:
+            yield session
+
+    # Пользователь запроса — из заголовка, без токенов
+    async def test_user(x_test_user: int = Header(...), db: AsyncSession = Depends(get_db)) -> User:
+        return await db.get(User, x_test_user)
+
+    app.dependency_overrides[get_db] = test_db
+    app.dependency_overrides[get_current_user] = test_user
+
+    async with sessions() as db:
+        users = [User(name=f"buyer {i}", email=f"buy-{tag}-{i}@test.local", password="x") for i in range(BUYERS)]
+        product = Product(title=f"stock {tag}", description="test", price=10.0, quantity=STOCK)
+        db.add_all([*users, product])
+        await db.commit()
+    user_ids = [user.id for user in users]
+
+    async def product_state():
+        async with sessions() as db:
+            quantity, reserved = (await db.execute(
+                select(Product.quantity, Product.reserved_quantity).where(Product.id == product.id)
+            )).one()
+            held = (await db.execute(
+                select(func.coalesce(func.sum(StockReservation.quantity), 0))
+                .where(StockReservation.product_id == product.id)
+            )).scalar()
+        return quantity, reserved, held
+
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=120) as client:
+            # 1. Все добавляют в корзину по штуке: резерв получают ровно STOCK покупателей
+            responses = await asyncio.gather(*(
+                client.post("/order/items", json={"product_id": product.id, "quantity": 1}, headers={"X-Test-User": str(user_id)})
+                for user_id in user_ids
+            ))
+            codes = [response.status_code for response in responses]
+            assert codes.count(201) == STOCK and codes.count(400) == BUYERS - STOCK, sorted(set(codes))
+            holders = [user_id for user_id, code in zip(user_ids, codes) if code == 201]
+            assert await product_state() == (STOCK, STOCK, STOCK)
+
+            # 2. Остальным — корзины без резерва (как до резервов), у половины держателей резерв истёк
+            others = [user_id for user_id in user_ids if user_id not in set(holders)]
+            expired, kept = holders[: STOCK // 2], holders[STOCK // 2:]
+            async with sessions() as db:
+                carts = [Order(user_id=user_id, status=OrderStatusEnum.ORDERED) for user_id in others]
+                db.add_all(carts)
+                await db.flush()
+                db.add_all([OrderItem(order_id=cart.id, product_id=product.id, quantity=1) for cart in carts])
+                await db.execute(
+                    update(StockReservation)
+                    .where(
+                        StockReservation.product_id == product.id,
+                        StockReservation.order_id.in_(select(Order.id).where(Order.user_id.in_(expired))),
+                    )
+                    .values(expires_at=func.now() - timedelta(minutes=1))
+                )
+                await db.commit()
+                result = await db.execute(
+                    select(Order.user_id, OrderItem.id)
+                    .join(Order)
+                    .where(OrderItem.product_id == product.id, Order.user_id.in_(user_ids))
+                )
+                cart_items = dict(result.all())
+
+            # 3. Все оформляют заказ одновременно, параллельно с чисткой просроченных резервов
+            async def sweep():
+                async with sessions() as db:
+                    return await sweep_expired_reservations(db)
+
+            checkouts = asyncio.gather(*(
+                client.post("/order/me/checkout", json={"items_ids": [cart_items[user_id]]}, headers={"X-Test-User": str(user_id)})
+                for user_id in user_ids
+            ))
+            responses, _ = await asyncio.gather(checkouts, asyncio.gather(*(sweep() for _ in range(SWEEPS))))
+        codes = dict(zip(user_ids, (response.status_code for response in responses)))
+
+        assert set(codes.values()) <= {200, 400}, sorted(set(codes.values()))
+        # Покупатель с действующим резервом не может проиграть гонку
+        assert all(codes[user_id] == 200 for user_id in kept)
+        quantity, reserved, held = await product_state()
+        assert quantity >= 0
+        # Все резервы сняты: либо перешли в списание, либо истекли
+        assert reserved == held == 0
+        async with sessions() as db:
+            completed = (await db.execute(
+                select(func.count(), func.coalesce(func.sum(OrderItem.quantity), 0))
+                .join(Order)
+                .where(OrderItem.product_id == product.id, Order.status == OrderStatusEnum.COMPLETED)
+            )).one()
+        sold = list(codes.values()).count(200)
+        assert completed == (sold, STOCK - quantity)
+    finally:
+        app.dependency_overrides.clear()
+        async with sessions() as db:
+            await db.execute(delete(OrderItem).where(OrderItem.product_id == product.id))
+            await db.execute(delete(Order).where(Order.user_id.in_(user_ids)))
+            await db.execute(delete(Product).where(Product.id == product.id))
+            await db.execute(delete(User).where(User.id.in_(user_ids)))
+            await db.commit()
+        await engine.dispose()
@@ -0,0 +1,66 @@
+import asyncio
+import random
+from uuid import uuid4
+from sqlalchemy import select, delete, func
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from app.comment_votes import toggle_comment_vote
+from app.models import User, Product, Comment, CommentRating
+
+VOTERS = 100
+TOGGLES = 3000
+CONCURRENCY = 20
+
+
+def test_parallel_toggles_keep_rating_equal_to_vote_sum(database_url):
+    asyncio.run(_parallel_toggles(database_url))
+
+
+async def _parallel_toggles(database_url: str) -> None:
+    engine = create_async_engine(database_url, pool_size=CONCURRENCY, max_overflow=0)
+    sessions = async_sessionmaker(bind=engine, expire_on_commit=False)
+    tag = uuid4().hex[:8]
+
+    async with sessions() as db:
+        users = [User(name=f"voter {i}", email=f"vote-{tag}-{i}@test.local", password="x") for i in range(VOTERS)]
+        product = Product(title=f"vote {tag}", description="test", price=1.0, quantity=0)
+        db.add_all([*users, product])
+        await db.flush()
+        comment = Comment(user_id=users[0].id, product_id=product.id, content="test")
+        db.add(comment)
+        await db.commit()
+    user_ids = [user.id for user in users]
+
+    # Один пользователь голосует много раз: получаются и добавления, и смена знака, и снятие голоса,
+    # в том числе параллельно с самим собой — это ветка повтора в toggle_comment_vote
+    rng = random.Random(tag)
+    votes = [(rng.choice(user_ids), rng.choice((1, -1))) for _ in range(TOGGLES)]
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def toggle(user_id: int, value: int) -> None:
+        async with semaphore, sessions() as db:
+            await toggle_comment_vote(db, comment.id, user_id, value)
+            await db.commit()
+
+    try:
+        results = await asyncio.gather(*(toggle(user_id, value) for user_id, value in votes), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        assert not errors, errors[:3]
+
+        async with sessions() as db:
+            rating = (await db.execute(select(Comment.rating).where(Comment.id == comment.id))).scalar()
+            total = (await db.execute(
+                select(func.coalesce(func.sum(CommentRating.value), 0)).where(CommentRating.comment_id == comment.id)
+            )).scalar()
+            per_user = (await db.execute(
+                select(func.count()).where(CommentRating.comment_id == comment.id).group_by(CommentRating.user_id)
+            )).scalars().all()
+        assert rating == total
+        assert all(count == 1 for count in per_user)
+    finally:
+        async with sessions() as db:
+            await db.execute(delete(CommentRating).where(CommentRating.comment_id == comment.id))
+            await db.execute(delete(Comment).where(Comment.id == comment.id))
+            await db.execute(delete(Product).where(Product.id == product.id))
+            await db.execute(delete(User).where(User.id.in_(user_ids)))
+            await db.commit()
+        await engine.dispose()
@@ -4,7 +4,7 @@ import { useAuth } from '../context/AuthContext';
 
 const BASE_URL = 'https://ruslik.taruman.ru';
 
-const AddToCartButton = ({ product, quantity = 1 }) => {
+const AddToCartButton = ({ product, quantity = 1, onAdded }) => {
   const { currentUser } = useAuth();
   const [cartMessage, setCartMessage] = useState('');
   const [adding, setAdding] = useState(false);
@@ -42,6 +42,8 @@ const AddToCartButton = ({ product, quantity = 1 }) => {
 
       setIsSuccess(true);
       setCartMessage('Инструмент добавлен в коризну!');
+      // Резерв корзины уменьшил свободный остаток
+      if (onAdded) onAdded();
       setTimeout(() => {
         setCartMessage('');
         setIsSuccess(false);
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useAuth } from '../context/AuthContext';
 import { ShoppingCart, Trash2, Plus, Minus, PackageX, ShoppingBag, Loader2, ExternalLink, CheckSquare } from 'lucide-react';
 import { Link } from 'react-router-dom';
@@ -6,6 +6,8 @@ import { ToastContainer, toast } from 'react-toastify';
 import 'react-toastify/dist/ReactToastify.css';
 
 const BASE_URL = 'https://ruslik.taruman.ru';
+// Изменения корзины копятся и уходят одним запросом после паузы в кликах
+const FLUSH_DELAY = 600;
 
 const Order = () => {
   const { currentUser } = useAuth();
@@ -47,61 +49,90 @@ const Order = () => {
     fetchOrderItems();
   }, []);
 
-  // Удаление товара
-  const handleRemove = async (itemId) => {
-    try {
-      const res = await fetch(`${BASE_URL}/order/items/${itemId}`, {
-        method: 'DELETE',
-        headers: {
-          'Authorization': `Bearer ${localStorage.getItem("token")}`
-        }
-      });
-      if (!res.ok) throw new Error('Ошибка удаления товара');
-      await fetchOrderItems();
-      toast.success('Товар удалён из корзины', { position: 'bottom-right' });
-    } catch (e) {
-      setError(e.message);
-      toast.error(`Ошибка: ${e.message}`, { position: 'bottom-right' });
-    }
-  };
+  // Несохранённые изменения: id позиции -> операция для POST /order/items/bulk
+  const pendingOps = useRef({});
+  const flushTimer = useRef(null);
 
-  // Увеличить количество
-  const handleIncrease = async (item) => {
+  const flushChanges = async () => {
+    clearTimeout(flushTimer.current);
+    const operations = Object.values(pendingOps.current);
+    if (operations.length === 0) return true;
+    pendingOps.current = {};
     try {
-      const res = await fetch(`${BASE_URL}/order/items/${item.id}`, {
-        method: 'PATCH',
+      const res = await fetch(`${BASE_URL}/order/items/bulk`, {
+        method: 'POST',
         headers: {
           'Content-Type': 'application/json',
           'Authorization': `Bearer ${localStorage.getItem("token")}`
         },
-        body: JSON.stringify({ quantity: item.quantity + 1 }),
+        body: JSON.stringify({ operations }),
       });
-      if (!res.ok) throw new Error('Ошибка увеличения количества');
-      await fetchOrderItems();
+      if (!res.ok) {
+        const errorData = await res.json();
+        throw new Error(errorData.detail || 'Ошибка сохранения корзины');
+      }
+      // Сверяем позиции с ответом сервера, товары остаются уже загруженные
+      const summary = await res.json();
+      const quantities = new Map(summary.items.map(line => [line.id, line.quantity]));
+      setOrderItems(prev => prev
+        .filter(item => quantities.has(item.id))
+        .map(item => ({ ...item, quantity: quantities.get(item.id) })));
+      return true;
     } catch (e) {
-      setError(e.message);
       toast.error(`Ошибка: ${e.message}`, { position: 'bottom-right' });
+      await fetchOrderItems();
+      return false;
     }
   };
 
+  const queueChange = (operation) => {
+    pendingOps.current[operation.item_id] = operation;
+    clearTimeout(flushTimer.current);
+    flushTimer.current = setTimeout(flushChanges, FLUSH_DELAY);
+  };
+
+  // Несохранённое при уходе со страницы
+  useEffect(() => () => {
+    clearTimeout(flushTimer.current);
+    const operations = Object.values(pendingOps.current);
+    if (operations.length === 0) return;
+    fetch(`${BASE_URL}/order/items/bulk`, {
+      method: 'POST',
+      keepalive: true,
+      headers: {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${localStorage.getItem("token")}`
+      },
+      body: JSON.stringify({ operations }),
+    });
+  }, []);
+
+  const changeQuantity = (item, quantity) => {
+    setOrderItems(prev => prev.map(line => line.id === item.id ? { ...line, quantity } : line));
+    queueChange({ op: 'set', item_id: item.id, quantity });
+  };
+
+  // Удаление товара
+  const handleRemove = (itemId) => {
+    setOrderItems(prev => prev.filter(item => item.id !== itemId));
+    setSelectedItems(prev => {
+      const next = { ...prev };
+      delete next[itemId];
+      return next;
+    });
+    queueChange({ op: 'remove', item_id: itemId });
+    toast.success('Товар удалён из корзины', { position: 'bottom-right' });
+  };
+
+  // Увеличить количество
+  const handleIncrease = (item) => {
+    changeQuantity(item, item.quantity + 1);
+  };
+
   // Уменьшить количество
-  const handleDecrease = async (item) => {
+  const handleDecrease = (item) => {
     if (item.quantity <= 1) return;
-    try {
-      const res = await fetch(`${BASE_URL}/order/items/${item.id}`, {
-        method: 'PATCH',
-        headers: {
-          'Content-Type': 'application/json',
-          'Authorization': `Bearer ${localStorage.getItem("token")}`
-        },
-        body: JSON.stringify({ quantity: item.quantity - 1 }),
-      });
-      if (!res.ok) throw new Error('Ошибка уменьшения количества');
-      await fetchOrderItems();
-    } catch (e) {
-      setError(e.message);
-      toast.error(`Ошибка: ${e.message}`, { position: 'bottom-right' });
-    }
+    changeQuantity(item, item.quantity - 1);
   };
 
   // Переключение чекбокса
@@ -137,6 +168,8 @@ const Order = () => {
       toast.error('Выберите хотя бы один товар для оформления!', { position: 'bottom-right' });
       return;
     }
+    // Сначала сохраняем отложенные изменения количества
+    if (!(await flushChanges())) return;
     try {
       const res = await fetch(`${BASE_URL}/order/me/checkout`, {
         method: "POST",
@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react';
-import { ShoppingBag, Package, Clock, AlertCircle, Loader2, PackageX, ChevronRight } from 'lucide-react';
+import { ShoppingBag, Package, Clock, AlertCircle, Loader2, PackageX, ChevronRight, ChevronDown } from 'lucide-react';
 import { Link } from 'react-router-dom';
 
 const BASE_URL = 'https://ruslik.taruman.ru';
@@ -24,21 +24,33 @@ const OrderStatus = ({ status }) => {
   );
 };
 
+const authHeaders = () => ({
+  'Content-Type': 'application/json',
+  'Authorization': `Bearer ${localStorage.getItem('token')}`,
+});
+
 const OrderHistory = () => {
   const [orders, setOrders] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState(null);
+  // Позиции раскрытых заказов: id заказа -> список позиций
+  const [itemsByOrder, setItemsByOrder] = useState({});
+  const [expanded, setExpanded] = useState({});
 
-  const fetchOrderHistory = async () => {
-    setLoading(true);
+  const fetchOrderHistory = async (cursor = null) => {
+    if (cursor) {
+      setLoadingMore(true);
+    } else {
+      setLoading(true);
+    }
     setError(null);
     try {
-      const response = await fetch(`${BASE_URL}/order/me/history`, {
+      const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+      const response = await fetch(`${BASE_URL}/order/me/history${query}`, {
         method: 'GET',
-        headers: {
-          'Content-Type': 'application/json',
-          'Authorization': `Bearer ${localStorage.getItem('token')}`,
-        },
+        headers: authHeaders(),
       });
 
       if (!response.ok) {
@@ -46,12 +58,35 @@ const OrderHistory = () => {
         throw new Error(errorData.detail || 'Ошибка загрузки истории заказов');
       }
 
-      const data = await response.json();
-      setOrders(Array.isArray(data) ? data : []);
+      const page = await response.json();
+      const data = Array.isArray(page?.data) ? page.data : [];
+      setOrders((prev) => (cursor ? [...prev, ...data] : data));
+      setNextCursor(page?.next_cursor || null);
     } catch (err) {
       setError(err.message);
     } finally {
       setLoading(false);
+      setLoadingMore(false);
+    }
+  };
+
+  const toggleOrder = async (orderId) => {
+    const isOpen = !expanded[orderId];
+    setExpanded((prev) => ({ ...prev, [orderId]: isOpen }));
+    if (!isOpen || itemsByOrder[orderId]) return;
+    try {
+      const response = await fetch(`${BASE_URL}/order/me/history/${orderId}/items`, {
+        method: 'GET',
+        headers: authHeaders(),
+      });
+      if (!response.ok) {
+        const errorData = await response.json().catch(() => ({}));
+        throw new Error(errorData.detail || 'Ошибка загрузки состава заказа');
+      }
+      const items = await response.json();
+      setItemsByOrder((prev) => ({ ...prev, [orderId]: Array.isArray(items) ? items : [] }));
+    } catch (err) {
+      setError(err.message);
     }
   };
 
@@ -129,17 +164,30 @@ const OrderHistory = () => {
               </div>
               <div className="flex flex-col items-end">
                 <span className="text-lg font-bold text-[#1A2238]">
-                  {order?.order_items?.reduce((sum, item) => sum + ((item?.quantity || 0) * (item?.product?.price || 0)), 0).toLocaleString()} ₽
+                  {(order?.total_amount || 0).toLocaleString()} ₽
                 </span>
                 <span className="text-sm text-gray-500">
-                  {order?.order_items?.length || 0} товаров
+                  {order?.items_count || 0} товаров
                 </span>
+                <button
+                  onClick={() => toggleOrder(order.id)}
+                  className="mt-2 inline-flex items-center text-sm font-semibold text-[#9E1946] hover:text-[#1A2238] transition-colors"
+                >
+                  {expanded[order.id] ? 'Скрыть состав' : 'Состав заказа'}
+                  <ChevronDown className={`ml-1 h-4 w-4 transition-transform ${expanded[order.id] ? 'rotate-180' : ''}`} />
+                </button>
               </div>
             </div>
 
-            {/* Items */}
+            {/* Items — загружаются при раскрытии заказа */}
+            {expanded[order.id] && !itemsByOrder[order.id] && (
+              <div className="p-6 flex justify-center">
+                <Loader2 className="h-6 w-6 text-[#1A2238] animate-spin" />
+              </div>
+            )}
+            {expanded[order.id] && (
             <div className="divide-y divide-gray-100">
-              {order?.order_items?.map((item) => (
+              {itemsByOrder[order.id]?.map((item) => (
                 <div
                   key={item?.id || Math.random()}
                   className="p-6 flex flex-col sm:flex-row items-center gap-6 bg-white hover:bg-gray-50 transition-colors"
@@ -157,7 +205,7 @@ const OrderHistory = () => {
                     </h3>
                     <div className="flex flex-wrap items-center gap-4 text-gray-500 text-sm mb-2">
                       <span>Количество: <span className="font-semibold text-[#1A2238]">{item?.quantity || 0}</span></span>
-                      <span>Цена: <span className="font-semibold text-[#9E1946]">{item?.product?.price || 0}₽</span></span>
+                      <span>Цена: <span className="font-semibold text-[#9E1946]">{item?.unit_price || 0}₽</span></span>
                     </div>
                   </div>
                   <div className="hidden sm:block">
@@ -168,12 +216,13 @@ const OrderHistory = () => {
                 </div>
               ))}
             </div>
+            )}
 
             {/* Barcode (если есть) */}
             {order?.barcode && (
               <div className="flex justify-center items-center bg-gray-50 py-6">
                 <img 
-                  src={`${BASE_URL}/static/barcodes/order_${order.id}.png`} 
+                  src={`${BASE_URL}${order.barcode}`} 
                   alt={`Штрихкод заказа #${order.id}`} 
                   className="w-40 h-40 object-contain"
                 />
@@ -189,6 +238,19 @@ const OrderHistory = () => {
           </div>
         ))}
       </div>
+
+      {nextCursor && (
+        <div className="flex justify-center mt-10">
+          <button
+            onClick={() => fetchOrderHistory(nextCursor)}
+            disabled={loadingMore}
+            className="inline-flex items-center bg-[#1A2238] hover:bg-[#9E1946] text-white px-7 py-3 rounded-xl text-lg font-semibold shadow-md transition-all disabled:opacity-60"
+          >
+            {loadingMore && <Loader2 className="mr-3 h-5 w-5 animate-spin" />}
+            Показать ещё
+          </button>
+        </div>
+      )}
     </div>
   );
 };
@@ -14,7 +14,13 @@ const ProductDetails = () => {
   const { productId } = useParams();
   const [product, setProduct] = useState(null);
   const [comments, setComments] = useState([]);
+  // Плоский список загруженных отзывов и ответов; отзывы приходят страницами по курсору
+  const [rawComments, setRawComments] = useState([]);
+  const [commentsCursor, setCommentsCursor] = useState(null);
+  const [commentsTotal, setCommentsTotal] = useState(0);
+  const [loadingMoreComments, setLoadingMoreComments] = useState(false);
   const [rating, setRating] = useState(0);
+  const [available, setAvailable] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [selectedImage, setSelectedImage] = useState(null);
@@ -25,7 +31,7 @@ const ProductDetails = () => {
     try {
       const [productRes, commentsRes, ratingRes] = await Promise.all([
         fetch(`${BASE_URL}/products/${productId}`),
-        fetch(`${BASE_URL}/products/${productId}/comments`),
+        fetch(`${BASE_URL}/products/${productId}/comments?cursor=`),
         fetch(`${BASE_URL}/products/${productId}/rating`)
       ]);
       if (!productRes.ok || !commentsRes.ok || !ratingRes.ok) throw new Error('Failed to load product data');
@@ -36,7 +42,11 @@ const ProductDetails = () => {
 
       setProduct(productData);
       setSelectedImage(productData.image);
-      setComments(buildCommentTree(commentsData));
+      const firstPage = Array.isArray(commentsData?.data) ? commentsData.data : [];
+      setRawComments(firstPage);
+      setComments(buildCommentTree(firstPage));
+      setCommentsCursor(commentsData?.next_cursor || null);
+      setCommentsTotal(commentsData?.total ?? firstPage.filter(c => !c.parent_id).length);
       setRating(ratingData.average || 0);
     } catch (err) {
       setError(err.message);
@@ -45,8 +55,40 @@ const ProductDetails = () => {
     }
   };
 
+  // Свободный остаток — отдельным некэшируемым запросом, карточка товара кэшируется
+  const fetchAvailability = async () => {
+    try {
+      const res = await fetch(`${BASE_URL}/products/${productId}/availability`);
+      if (!res.ok) return;
+      const data = await res.json();
+      setAvailable(data.available);
+    } catch (err) {
+      // Без остатка показываем количество на складе
+    }
+  };
+
+  const fetchMoreComments = async () => {
+    if (!commentsCursor) return;
+    setLoadingMoreComments(true);
+    try {
+      const res = await fetch(`${BASE_URL}/products/${productId}/comments?cursor=${encodeURIComponent(commentsCursor)}`);
+      if (!res.ok) throw new Error('Failed to load comments');
+      const page = await res.json();
+      const merged = [...rawComments, ...(Array.isArray(page?.data) ? page.data : [])];
+      setRawComments(merged);
+      setComments(buildCommentTree(merged));
+      setCommentsCursor(page?.next_cursor || null);
+    } catch (err) {
+      setError(err.message);
+    } finally {
+      setLoadingMoreComments(false);
+    }
+  };
+
   useEffect(() => {
+    setAvailable(null);
     fetchProductData();
+    fetchAvailability();
     // eslint-disable-next-line
   }, [productId]);
 
@@ -239,7 +281,7 @@ const ProductDetails = () => {
                 <div className="flex items-center space-x-4 mb-6">
                   <StarRating rating={rating} showNumber={true} />
                   <span className="text-sm text-gray-500">
-                    ({comments.length} отзыв{comments.length !== 1 ? 'ов' : ''})
+                    ({commentsTotal} отзыв{commentsTotal !== 1 ? 'ов' : ''})
                   </span>
                 </div>
               </div>
@@ -287,8 +329,8 @@ const ProductDetails = () => {
                   )}
                   <div className="flex justify-between">
                     <span className="text-gray-600">Наличие:</span>
-                    <span className={`font-medium ${product.quantity > 0 ? 'text-green-600' : 'text-red-600'}`}>
-                      {product.quantity > 0 ? `В наличии (${product.quantity})` : 'Нет в наличии'}
+                    <span className={`font-medium ${(available ?? product.quantity) > 0 ? 'text-green-600' : 'text-red-600'}`}>
+                      {(available ?? product.quantity) > 0 ? `В наличии (${available ?? product.quantity})` : 'Нет в наличии'}
                     </span>
                   </div>
                 </div>
@@ -308,8 +350,8 @@ const ProductDetails = () => {
                   </div>
                 </div>
                 <div className="space-y-3">
-                  {product.quantity > 0 ? (
-                    <AddToOrder product={product} />
+                  {(available ?? product.quantity) > 0 ? (
+                    <AddToOrder product={product} onAdded={fetchAvailability} />
                   ) : (
                     <button 
                       disabled 
@@ -353,6 +395,17 @@ const ProductDetails = () => {
                 />
               ))
             )}
+            {commentsCursor && (
+              <div className="flex justify-center">
+                <button
+                  onClick={fetchMoreComments}
+                  disabled={loadingMoreComments}
+                  className="px-6 py-2 rounded-lg border border-gray-300 text-gray-700 font-medium hover:bg-gray-50 transition-colors disabled:opacity-60"
+                >
+                  {loadingMoreComments ? 'Загрузка...' : 'Показать ещё отзывы'}
+                </button>
+              </div>
+            )}
           </div>
         </div>
       </div>